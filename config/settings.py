@@ -21,6 +21,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
 from pathlib import Path
+import tempfile
 import environ
 env = environ.Env()
 environ.Env.read_env()
@@ -54,14 +55,11 @@ INSTALLED_APPS = [
 
     # Third Party Apps
 
-    "debug_toolbar",
-
 ]
 
 MIDDLEWARE = [
-    # debug tolbar
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
-
+    'core.middleware.RequestProfilingMiddleware',
+    'core.middleware.ReplicaReadsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,12 +71,23 @@ MIDDLEWARE = [
 
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    # debug tolbar
+    MIDDLEWARE.insert(1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 # Configure Internal IPs
 
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
 
+# Requests slower than this many milliseconds are sampled with their queries
+# to the core.SlowRequest ring buffer; 0 turns sampling off.
+REQUEST_PROFILING_SLOW_MS = env.int('DJANGO_SLOW_REQUEST_MS', default=0)
+REQUEST_PROFILING_SAMPLE_RATE = env.float('DJANGO_SLOW_REQUEST_SAMPLE_RATE', default=1.0)
+REQUEST_PROFILING_BUFFER_SIZE = env.int('DJANGO_SLOW_REQUEST_BUFFER_SIZE', default=100)
+
 
 ROOT_URLCONF = 'config.urls'
 
@@ -106,14 +115,46 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': env.str('DATABASE_ENGINE', default='django.db.backends.mysql'),
         'NAME': env.str('DATABASE_NAME'),
-        'HOST': 'localhost',
+        'HOST': env.str('DATABASE_HOST', default='localhost'),
         'USER': env.str('DATABASE_USER'),
         'PASSWORD': env.str('DATABASE_PASS'),
+        # Seconds a connection is reused across requests; 0 closes it after
+        # every request. Health checks replace a reused connection the server
+        # has dropped instead of failing the request.
+        'CONN_MAX_AGE': env.int('DATABASE_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DATABASE_CONN_HEALTH_CHECKS', default=True),
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # A file rather than SQLite's in-memory test database, which the threads
+    # of the concurrency tests cannot share, kept out of the repository.
+    DATABASES['default']['TEST'] = {'NAME': str(Path(tempfile.gettempdir()) / 'store_test_db.sqlite3')}
+
+# Optional read replicas, one alias each: a host sharing the primary's database
+# name and credentials, or a database URL of its own, e.g.
+# sqlite:////var/db/replica.sqlite3. The tests read them through the primary's
+# test database.
+DATABASE_REPLICAS = []
+for index, replica in enumerate([
+    *({'HOST': host} for host in env.list('DATABASE_REPLICA_HOSTS', default=[])),
+    *(env.db_url_config(url) for url in env.list('DATABASE_REPLICA_URLS', default=[])),
+]):
+    alias = f'replica{index or ""}'
+    DATABASES[alias] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# GET requests to the views of these apps read from the replicas, except for
+# this many seconds after the same client sent a write.
+DATABASE_REPLICA_APPS = ['store']
+DATABASE_REPLICA_STICKY_SECONDS = env.int('DATABASE_REPLICA_STICKY_SECONDS', default=5)
+
+# Seconds the rendered responses of store.caching are kept.
+STORE_CACHE_TIMEOUT = env.int('STORE_CACHE_TIMEOUT', default=300)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -180,4 +221,22 @@ DJOSER = {
     }
 }
 
-AUTH_USER_MODEL = "core.CustomUser"
\ No newline at end of file
+AUTH_USER_MODEL = "core.CustomUser"
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One JSON line per request, written by core.middleware.RequestProfilingMiddleware.
+        'core.requests': {
+            'handlers': ['console'],
+            'level': env.str('DJANGO_REQUEST_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
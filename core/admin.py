@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from django.utils.html import format_html_join
+from .models import CustomUser, SlowRequest
 
 
 @admin.register(CustomUser)
@@ -13,4 +14,26 @@ class CustomUserAdmin(UserAdmin):
                 "fields": ("username", 'email', "password1", "password2", 'first_name', 'last_name'),
             },
         ),
-    )
\ No newline at end of file
+    )
+
+@admin.register(SlowRequest)
+class SlowRequestAdmin(admin.ModelAdmin):
+    list_display = ['datetime_created', 'method', 'path', 'status_code', 'total_ms', 'db_ms', 'query_count', 'duplicate_count', 'serializer_ms']
+    list_filter = ['method', 'status_code']
+    search_fields = ['path']
+    ordering = ['-id']
+    fields = ['datetime_created', 'method', 'path', 'status_code', 'total_ms', 'db_ms', 'query_count', 'duplicate_count', 'serializer_ms', 'query_list']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='queries')
+    def query_list(self, sample):
+        return format_html_join(
+            '', '<pre style="white-space: pre-wrap">{} ms  {}  {}</pre>',
+            ((query['ms'], query['sql'], query['params']) for query in sample.queries),
+        )
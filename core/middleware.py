@@ -0,0 +1,153 @@
+import json
+import logging
+import random
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .models import SlowRequest
+from .profiling import RequestProfile, current_profile
+from .routers import replica_reads
+
+logger = logging.getLogger('core.requests')
+
+
+class ProfiledStream:
+    """
+    The body of a streaming response, finishing its profile once consumed,
+    or once the response is closed without being read to the end.
+    """
+
+    def __init__(self, content, finish):
+        self.content = content
+        self.finish = finish
+        self.finished = False
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.finish()
+
+
+class RequestProfilingMiddleware:
+    """
+    Measures total time, DB time, query and duplicate query counts and
+    serializer time of every request. They are sent back in a Server-Timing
+    header and logged as one JSON line. Requests slower than
+    REQUEST_PROFILING_SLOW_MS are sampled, with their queries, to the
+    SlowRequest ring buffer. The body of a streaming response is read after
+    this middleware returns, so its queries are timed until the body is done
+    and it is only logged then, without a Server-Timing header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_PROFILING_SLOW_MS', 0)
+        self.sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        sampling = bool(self.slow_ms) and random.random() < self.sample_rate
+        profile = RequestProfile(keep_queries=sampling)
+        stack = ExitStack()
+        token = current_profile.set(profile)
+        try:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        except BaseException:
+            stack.close()
+            raise
+        finally:
+            current_profile.reset(token)
+
+        if response.streaming:
+            # StreamingHttpResponse closes the new content with the response.
+            response.streaming_content = ProfiledStream(
+                response.streaming_content, lambda: self.finish(request, response, profile, sampling, stack),
+            )
+        else:
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={profile.total_time * 1000:.1f}',
+                f'db;dur={profile.db_time * 1000:.1f};desc="{profile.query_count} queries"',
+                f'dup;desc="{profile.duplicate_count} duplicate queries"',
+                f'serializer;dur={profile.serializer_time * 1000:.1f}',
+            ])
+            self.finish(request, response, profile, sampling, stack)
+        return response
+
+    def finish(self, request, response, profile, sampling, stack):
+        stack.close()
+        total_ms = profile.total_time * 1000
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'db_ms': round(profile.db_time * 1000, 1),
+            'queries': profile.query_count,
+            'duplicate_queries': profile.duplicate_count,
+            'serializer_ms': round(profile.serializer_time * 1000, 1),
+        }))
+
+        if sampling and total_ms >= self.slow_ms:
+            self.record(request, response, profile, total_ms)
+
+    def record(self, request, response, profile, total_ms):
+        try:
+            SlowRequest.objects.record(
+                method=request.method,
+                path=request.get_full_path()[:500],
+                status_code=response.status_code,
+                total_ms=total_ms,
+                db_ms=profile.db_time * 1000,
+                query_count=profile.query_count,
+                duplicate_count=profile.duplicate_count,
+                serializer_ms=profile.serializer_time * 1000,
+                queries=profile.queries,
+            )
+        except DatabaseError:
+            logger.exception('Could not record slow request %s', request.path)
+
+
+class ReplicaReadsMiddleware:
+    """
+    Lets GET and HEAD requests to the views of DATABASE_REPLICA_APPS read
+    from the replicas, unless the view class sets `replica_reads = False`.
+    A request with any other method marks the client with
+    a cookie, and for DATABASE_REPLICA_STICKY_SECONDS its reads stay on the
+    primary, so it sees its own writes before the replicas catch up.
+    """
+    cookie_name = 'primary_reads'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.apps = getattr(settings, 'DATABASE_REPLICA_APPS', ['store'])
+        self.sticky_seconds = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+
+    def __call__(self, request):
+        token = replica_reads.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and self.sticky_seconds:
+            response.set_cookie(self.cookie_name, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        if (
+            request.method in ('GET', 'HEAD')
+            and self.cookie_name not in request.COOKIES
+            and view_class is not None
+            and view_class.__module__.split('.')[0] in self.apps
+            and getattr(view_class, 'replica_reads', True)
+        ):
+            replica_reads.set(True)
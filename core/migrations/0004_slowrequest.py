@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_customuser_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('total_ms', models.FloatField()),
+                ('db_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField()),
+                ('duplicate_count', models.PositiveIntegerField()),
+                ('serializer_ms', models.FloatField()),
+                ('queries', models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -1,7 +1,34 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
 
 
 class CustomUser(AbstractUser):
-    email = models.EmailField(unique=True)
\ No newline at end of file
+    email = models.EmailField(unique=True)
+
+class SlowRequestManager(models.Manager):
+    def record(self, **fields):
+        """Stores a sample and drops the oldest ones beyond REQUEST_PROFILING_BUFFER_SIZE."""
+        sample = self.create(**fields)
+        size = getattr(settings, 'REQUEST_PROFILING_BUFFER_SIZE', 100)
+        self.filter(pk__lte=sample.pk - size).delete()
+        return sample
+
+
+class SlowRequest(models.Model):
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    total_ms = models.FloatField()
+    db_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    duplicate_count = models.PositiveIntegerField()
+    serializer_ms = models.FloatField()
+    queries = models.JSONField(default=list)
+
+    objects = SlowRequestManager()
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.total_ms:.0f} ms)'
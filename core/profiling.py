@@ -0,0 +1,72 @@
+import time
+from contextvars import ContextVar
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    """
+    Execute wrapper timing the queries of one request and counting the
+    duplicate ones. The full query list is only kept when `keep_queries` is
+    set, i.e. when slow requests are sampled.
+    """
+
+    def __init__(self, keep_queries=False):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.seen = set()
+        self.duplicate_count = 0
+        self.queries = [] if keep_queries else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += duration
+            self.count_duplicate(sql, params)
+            if self.queries is not None:
+                self.queries.append({'sql': sql, 'params': str(params), 'ms': round(duration * 1000, 3)})
+
+    def count_duplicate(self, sql, params):
+        # Parameters are hashed as they are; only unhashable ones, such as
+        # the rows of executemany, are turned into strings.
+        key = (sql, tuple(params) if isinstance(params, list) else params)
+        try:
+            duplicate = key in self.seen
+        except TypeError:
+            key = (sql, str(params))
+            duplicate = key in self.seen
+        if duplicate:
+            self.duplicate_count += 1
+        else:
+            self.seen.add(key)
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.start
+
+
+class ProfiledSerializerMixin:
+    """
+    Adds the time spent turning instances into primitives to the current
+    request profile. Only the outermost serializer is timed, so nested and
+    list serializers are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        profile = current_profile.get()
+        if profile is None or profile.serializing:
+            return super().to_representation(instance)
+        profile.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serializer_time += time.perf_counter() - start
+            profile.serializing = False
@@ -0,0 +1,33 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set by core.middleware.ReplicaReadsMiddleware for the requests whose reads
+# may be answered by a replica.
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to one of the DATABASE_REPLICAS while `replica_reads` is set
+    and everything else to the primary. Reads inside a transaction on the
+    primary stay there, so they see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or not replica_reads.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold copies of the primary's rows.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
@@ -1,11 +1,33 @@
 from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
 from django.db.models import Count
 from django.http.request import HttpRequest
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.http import urlencode
 
-from store.models import Cart, CartItem, Category, Comment, Customer, Order, OrderItem, Product
+from store import rollups
+from store.caching import product_cache
+from store.models import Cart, CartItem, Category, CategoryDailySales, Comment, Customer, Order, OrderItem, OutboxEvent, Product, ProductDailySales
+
+
+class PrunedChangeList(ChangeList):
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # list_editable saves go through these instances, and saving deferred
+        # fields is skipped, so only plain listings are pruned.
+        if request.method == 'GET':
+            queryset = queryset.only(*self.model_admin.list_only)
+        return queryset
+
+
+class ListOnlyMixin:
+    """Loads only the `list_only` columns on the change list page."""
+    list_only = []
+
+    def get_changelist(self, request, **kwargs):
+        return PrunedChangeList
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -32,12 +54,13 @@ class InventoryFilter(admin.SimpleListFilter):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = [
         'id',
         'name',
         'inventory',
         'unit_price',
+        'effective_price',
         'inventory_status',
         'product_category',
         'num_of_comments',
@@ -45,6 +68,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_per_page = 10
     list_editable = ['unit_price']
     list_select_related = ['category']
+    list_only = ['name', 'inventory', 'unit_price', 'effective_price', 'approved_comment_count', 'category__title']
     list_filter = ['datetime_created', InventoryFilter]
     actions = ['clear_inventory']
     prepopulated_fields = {
@@ -63,12 +87,7 @@ class ProductAdmin(admin.ModelAdmin):
     def product_category(self, product: Product):
         return product.category.title
 
-    def get_queryset(self, request):
-        return super().get_queryset(request) \
-            .prefetch_related('comments') \
-            .annotate(comments_count=Count('comments'))
-
-    @admin.display(ordering='comments_count', description='# comments')
+    @admin.display(ordering='approved_comment_count', description='# approved comments')
     def num_of_comments(self, product: Product):
         url = (
             reverse('admin:store_comment_changelist')
@@ -76,14 +95,16 @@ class ProductAdmin(admin.ModelAdmin):
             '?'
             +
             urlencode({
-                'product__id': product.id
+                'product__id': product.id,
+                'status__exact': Comment.COMMENT_STATUS_APPROVED,
             })
         )
-        return format_html('<a href="{}">{}</a>', url, product.comments_count)
+        return format_html('<a href="{}">{}</a>', url, product.approved_comment_count)
 
     @admin.action(description='Clear Inventory')
     def clear_inventory(self, request, queryset):
-        update_count = queryset.update(inventory=0)
+        update_count = queryset.update(inventory=0, datetime_modified=timezone.now())
+        product_cache.invalidate()
         self.message_user(
             request,
             f'{update_count} of products inventories cleard to zero.',
@@ -100,7 +121,7 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = [
         'id',
         'customer',
@@ -110,6 +131,8 @@ class OrderAdmin(admin.ModelAdmin):
         ]
     list_per_page = 10
     list_editable = ['status']
+    list_select_related = ['customer__user']
+    list_only = ['customer__user__first_name', 'customer__user__last_name', 'status', 'datetime_created']
     ordering = ['-datetime_created']
     search_fields = ['id']
     inlines = [OrderItemInline]
@@ -117,27 +140,40 @@ class OrderAdmin(admin.ModelAdmin):
     def get_queryset(self, request: HttpRequest):
         return super()\
                 .get_queryset(request)\
-                .prefetch_related('items') \
                 .annotate(items_count=Count('items'))
 
+    def save_related(self, request, form, formsets, change):
+        # Items edited inline send no order signal; move the order's rows
+        # from its items before the edit to its items after it, in the
+        # transaction the admin saves the form in.
+        order = form.instance
+        removed = rollups.order_deltas(order, order.status, -1)
+        super().save_related(request, form, formsets, change)
+        rollups.apply_deltas(rollups.merge_deltas(removed, rollups.order_deltas(order, order.status, 1)))
+
     @admin.display(ordering='items_count', description='# items')
     def num_of_items(self, order: Order):
         return order.items_count
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'status', 'datetime_created']
     list_per_page = 10
+    list_select_related = ['product']
+    list_only = ['product__name', 'status', 'datetime_created']
     list_editable = ['status']
+    list_filter = ['status']
     ordering = ['-datetime_created']
     autocomplete_fields = ['product']
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ['first_name', 'last_name', 'email', 'phone_number']
     list_per_page = 10
+    list_select_related = ['user']
+    list_only = ['phone_number', 'user__first_name', 'user__last_name', 'user__email']
     ordering = ['user__last_name', 'user__first_name']
     search_fields = ['user__first_name__istartswith', 'user__last_name__istartswith']
 
@@ -150,13 +186,15 @@ class CustomerAdmin(admin.ModelAdmin):
     def email(self, customer):
         return customer.user.email
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ['order',
                     'product',
                     'quantity',
                     'unit_price',
                     ]
     list_per_page = 10
+    list_select_related = ['order', 'product']
+    list_only = ['order__id', 'product__name', 'quantity', 'unit_price']
     # ordering = ['-datetime_created']
     autocomplete_fields = ['product']
 
@@ -169,8 +207,50 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['id', 'created_at']
+    list_display = ['id', 'created_at', 'items_count', 'total_price']
+    readonly_fields = ['items_count', 'total_price']
     inlines = [CartItemInline, ]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Cart.objects.filter(pk=form.instance.pk).refresh_totals()
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    list_filter = ['status']
+    list_per_page = 50
+    date_hierarchy = 'day'
+    ordering = ['-day']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ProductDailySales)
+class ProductDailySalesAdmin(DailySalesAdmin):
+    list_display = ['day', 'product', 'status', 'units', 'revenue', 'orders']
+    list_select_related = ['product']
+    autocomplete_fields = ['product']
+
+
+@admin.register(CategoryDailySales)
+class CategoryDailySalesAdmin(DailySalesAdmin):
+    list_display = ['day', 'category', 'status', 'units', 'revenue', 'orders']
+    list_select_related = ['category']
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'status', 'attempts', 'created_at', 'processed_at']
+    list_filter = ['status', 'event']
+    list_per_page = 10
+    ordering = ['-id']
+
 
 admin.site.register(Category)
@@ -0,0 +1,241 @@
+import math
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from store import pricing, rollups, search
+from store.caching import product_cache
+from store.models import Cart, CartItem, Category, Comment, Customer, Discount, Order, OrderItem, Product
+
+ROLES = ('anonymous', 'user', 'staff')
+
+Endpoint = namedtuple(
+    'Endpoint', ['name', 'path', 'max_queries', 'method', 'data', 'roles', 'setup'],
+    defaults=['GET', None, ROLES, None],
+)
+
+
+def checkout_cart(params):
+    """A fresh cart for every checkout, built outside the measured request."""
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=product_id, quantity=1) for product_id in params['products'][:5]
+    ])
+    Cart.objects.filter(pk=cart.pk).refresh_totals()
+    return {'checkout_cart': cart.id}
+
+
+# max_queries is the budget of a cold (uncached) request with full pages; it
+# must not grow with the size of the data. Every role listed must get a 2xx.
+ENDPOINTS = [
+    Endpoint('product-list', '/store/products/', 2),
+    Endpoint('product-list-keyset', '/store/products/?pagination=keyset&ordering=unit_price', 2),
+    Endpoint('product-search', '/store/products/?search={search}', 2),
+    Endpoint('product-detail', '/store/products/{product}/', 2),
+    Endpoint('category-list', '/store/categories/', 1),
+    Endpoint('category-detail', '/store/categories/{category}/', 1),
+    Endpoint('comment-list', '/store/products/{product}/comments/', 1),
+    Endpoint('comment-detail', '/store/products/{product}/comments/{comment}/', 1),
+    Endpoint('cart-detail', '/store/carts/{cart}/', 3),
+    Endpoint('cart-item-list', '/store/carts/{cart}/items/', 1),
+    Endpoint('customer-list', '/store/customers/', 1, roles=('staff',)),
+    Endpoint('customer-detail', '/store/customers/{customer}/', 1, roles=('staff',)),
+    Endpoint('customer-me', '/store/customers/me/', 1, roles=('user', 'staff')),
+    Endpoint('order-list', '/store/orders/', 2, roles=('user', 'staff')),
+    Endpoint('order-detail', '/store/orders/{order}/', 2, roles=('user', 'staff')),
+    Endpoint('sales-report', '/store/sales/', 1, roles=('staff',)),
+    Endpoint('cache-stats', '/store/cache-stats/', 0, roles=('staff',)),
+    # One query per export_chunk_size rows; the seeded category fits one chunk.
+    Endpoint('product-export', '/store/products/export/?category={category}', 1, roles=('staff',)),
+    Endpoint('cart-create', '/store/carts/', 2, 'POST'),
+    Endpoint('cart-item-add', '/store/carts/{cart}/items/', 5, 'POST', {'product': '{product}', 'quantity': 1}),
+    Endpoint('cart-item-update', '/store/carts/{cart}/items/{item}/', 7, 'PATCH', {'quantity': 2}),
+    Endpoint(
+        'product-bulk', '/store/products/bulk/', 10, 'POST',
+        [{'title': f'Imported Product {i}', 'price': '9.90', 'category': '{category}', 'inventory': 1, 'description': ''} for i in range(10)],
+        roles=('staff',),
+    ),
+    Endpoint(
+        'checkout', '/store/orders/', 22, 'POST', {'cart_id': '{checkout_cart}'},
+        roles=('user', 'staff'), setup=checkout_cart,
+    ),
+]
+
+
+def benchmark_user(username, **extra_fields):
+    User = get_user_model()
+    user = User.objects.filter(username=username).first()
+    return user or User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='benchmark', **extra_fields,
+    )
+
+
+def seed(products=100, orders=20, items_per_order=5, comments_per_product=3):
+    """Creates a catalog, a customer with orders, a full cart and a staff user; returns the path parameters."""
+    category = Category.objects.create(title='Benchmark Category')
+    other_category = Category.objects.create(title='Other Benchmark Category')
+    discount = Discount.objects.create(discount=0.1, description='Benchmark')
+    first_id = Product.objects.bulk_create([
+        Product(
+            name=f'Benchmark Product {i}', slug=f'benchmark-product-{i}',
+            category=category if i % 2 else other_category,
+            description='', unit_price=Decimal(10 + i % 90), inventory=1000,
+        ) for i in range(products)
+    ])[0].id
+    product_ids = list(Product.objects.filter(id__gte=first_id).values_list('id', flat=True))
+    Product.discounts.through.objects.bulk_create([
+        Product.discounts.through(product_id=product_id, discount=discount) for product_id in product_ids[::3]
+    ])
+    pricing.refresh_effective_prices(Product.objects.filter(pk__in=product_ids))
+    Comment.objects.bulk_create([
+        Comment(product_id=product_id, name='Benchmark', body='Comment', status=Comment.COMMENT_STATUS_APPROVED)
+        for product_id in product_ids for _ in range(comments_per_product)
+    ])
+    search.index_products(product_ids)
+
+    user = benchmark_user('benchmark-user')
+    staff = benchmark_user('benchmark-staff', is_staff=True)
+    customer = Customer.objects.get(user=user)
+
+    order_ids = [Order.objects.create(customer=customer).id for _ in range(orders)]
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order_id, product_id=product_id, quantity=1, unit_price=Decimal(10))
+        for order_id in order_ids for product_id in product_ids[:items_per_order]
+    ])
+
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=product_id, quantity=1) for product_id in product_ids[:20]
+    ])
+    Cart.objects.filter(pk=cart.pk).refresh_totals()
+    rollups.rebuild()
+
+    return {
+        'params': {
+            'product': product_ids[0], 'category': category.id, 'cart': cart.id,
+            'item': CartItem.objects.get(cart=cart, product_id=product_ids[1]).id,
+            'order': order_ids[0], 'search': 'bench', 'products': product_ids, 'customer': customer.id,
+            'comment': Comment.objects.filter(product_id=product_ids[0]).values_list('id', flat=True).first(),
+        },
+        'users': {'anonymous': None, 'user': user, 'staff': staff},
+    }
+
+
+class CountingCursor:
+    """Database cursor proxy counting the rows fetched through it."""
+
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self.recorder.rows += row is not None
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.recorder.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.recorder.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.recorder.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class QueryRecorder:
+    """Execute wrapper counting the queries of a request and the rows they fetch."""
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        wrapper = context['cursor']
+        if not isinstance(wrapper.cursor, CountingCursor):
+            wrapper.cursor = CountingCursor(wrapper.cursor, self)
+        return execute(sql, params, many, context)
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def fill(data, params):
+    if isinstance(data, dict):
+        return {key: fill(value, params) for key, value in data.items()}
+    if isinstance(data, list):
+        return [fill(value, params) for value in data]
+    return data.format(**params) if isinstance(data, str) else data
+
+
+def request(client, endpoint, params):
+    path = endpoint.path.format(**params)
+    data = fill(endpoint.data, params)
+    response = getattr(client, endpoint.method.lower())(path, data, format='json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return path, response
+
+
+def measure(endpoint, params, user=None, repeat=10):
+    """
+    Requests the endpoint `repeat` times; query count and rows are taken from
+    the first, uncached run. Each request of an endpoint with a `setup` gets
+    its own fresh parameters, prepared outside the timing.
+    """
+    client = APIClient()
+    client.force_authenticate(user)
+    product_cache.invalidate()
+
+    timings = []
+    recorder = QueryRecorder()
+    for run in range(repeat):
+        run_params = {**params, **(endpoint.setup(params) if endpoint.setup else {})}
+        start = time.perf_counter()
+        if run == 0:
+            with connection.execute_wrapper(recorder):
+                path, response = request(client, endpoint, run_params)
+        else:
+            request(client, endpoint, run_params)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'path': path,
+        'method': endpoint.method,
+        'status': response.status_code,
+        'queries': recorder.count,
+        'rows': recorder.rows,
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+    }
+
+
+def run(seeded, repeat=10, endpoints=None, roles=ROLES):
+    """Returns {endpoint name: {role: measurement}} for the roles of each endpoint."""
+    # The test client's host is only allowed by the test runner.
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        return {
+            endpoint.name: {
+                role: measure(endpoint, seeded['params'], seeded['users'][role], repeat)
+                for role in roles if role in endpoint.roles
+            }
+            for endpoint in endpoints or ENDPOINTS
+        }
@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlencode
+from rest_framework.response import Response
+
+from core.routers import replica_reads
+
+
+class ResponseCache:
+    """
+    Rendered response bytes keyed on the request URL, host included, the
+    normalized query string and renderer. Every key embeds a version number,
+    so invalidating is a single write that orphans all previously cached
+    responses.
+
+    The version is the time of the last invalidation in microseconds. If the
+    cache evicts it, it is seeded with the current time, which no earlier
+    version can equal, so orphaned responses never come back.
+    """
+
+    default_timeout = 300
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.version_key = f'store:{namespace}:version'
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'STORE_CACHE_ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        # Entries always expire, so one computed from stale data cannot outlive it for long.
+        return getattr(settings, 'STORE_CACHE_TIMEOUT', None) or self.default_timeout
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, time.time_ns() // 1000, timeout=None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def get_last_modified(self):
+        """When the cached responses were last invalidated, per the version."""
+        return datetime.fromtimestamp(self.get_version() / 1e6, timezone.utc)
+
+    def invalidate(self):
+        # Never go back, even if clocks of two hosts disagree.
+        version = self.cache.get(self.version_key) or 0
+        self.cache.set(self.version_key, max(time.time_ns() // 1000, version + 1), timeout=None)
+
+    def make_key(self, request):
+        query = urlencode(sorted(
+            (key, value) for key, values in request.query_params.lists() for value in values
+        ))
+        # Paginated responses embed absolute next/previous links.
+        raw = f'{request.build_absolute_uri(request.path)}?{query}|{request.accepted_renderer.format}'
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        return f'store:{self.namespace}:{self.get_version()}:{digest}'
+
+    def get(self, key):
+        cached = self.cache.get(key)
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached
+
+    def set(self, key, response):
+        self.cache.set(key, (response.content, response['Content-Type']), self.timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+product_cache = ResponseCache('products')
+comment_cache = ResponseCache('comments')
+RESPONSE_CACHES = [product_cache, comment_cache]
+
+
+class CachedResponseMixin:
+    """
+    Serves anonymous `list`/`retrieve` requests of a viewset from
+    `response_cache`, storing the rendered bytes on a miss.
+
+    The responses it caches are computed on the primary database: cached
+    under the current version, one built from a lagging replica would be
+    served until the next invalidation. Uncached requests may still read from
+    a replica.
+    """
+    response_cache = None
+
+    def is_cacheable(self, request):
+        return request.method == 'GET' and not request.user.is_authenticated
+
+    def cached(self, view, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return view(request, *args, **kwargs)
+        key = self.response_cache.make_key(request)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+        self.response_cache_key = key
+        response = view(request, *args, **kwargs)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # The user is known once authenticated; ReplicaReadsMiddleware resets
+        # the flag when the request ends.
+        if self.action in ('list', 'retrieve') and self.is_cacheable(request):
+            replica_reads.set(False)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'response_cache_key', None)
+        if key and isinstance(response, Response) and response.status_code == 200:
+            response.render()
+            self.response_cache.set(key, response)
+        return response
+
+
+class ConditionalRetrieveMixin:
+    """
+    Answers `If-None-Match`/`If-Modified-Since` on `retrieve` from validators
+    computed before the serializer runs. `get_detail_validators` returns a
+    version string and an optional last modified datetime, or None to skip.
+    """
+
+    def get_detail_validators(self):
+        return None
+
+    def conditional(self, validators, view, request, *args, **kwargs):
+        if validators is None:
+            return view(request, *args, **kwargs)
+        version, last_modified = validators
+        raw = f'{request.get_full_path()}|{request.accepted_renderer.format}|{version}'
+        etag = '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+        last_modified = last_modified and int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(self.get_detail_validators(), super().retrieve, request, *args, **kwargs)
+
+
+class ConditionalGetMixin(ConditionalRetrieveMixin):
+    """Conditional `list` as well, validated by `get_list_validators`."""
+
+    def get_list_validators(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.get_list_validators(), super().list, request, *args, **kwargs)
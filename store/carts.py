@@ -0,0 +1,33 @@
+import time
+
+from django.db import transaction
+
+from store.models import Cart, CartItem
+
+
+def purge_expired(before, batch_size=1000, pause=0):
+    """
+    Deletes the carts inactive since `before`, with their items, at most
+    `batch_size` carts per transaction so no lock is held for long. Yields
+    the numbers of carts and items deleted by each batch.
+
+    Cart keys are random UUIDs, so a primary key range says nothing about
+    age: each batch is the oldest `batch_size` expired carts, read from the
+    last_activity index, deleted by primary key. Carts locked by a request
+    adding items are skipped and picked up by a later run.
+    """
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Cart.objects.expired(before)
+                .select_for_update(skip_locked=True)
+                .order_by('last_activity')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return
+            _, deleted = Cart.objects.filter(pk__in=ids).delete()
+        yield deleted.get(Cart._meta.label, 0), deleted.get(CartItem._meta.label, 0)
+        if len(ids) < batch_size:
+            return
+        time.sleep(pause)
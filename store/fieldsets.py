@@ -0,0 +1,58 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def fieldset_params(request):
+    """
+    The `?fields=` and `?expand=` lists of a read request, None when the
+    parameter is absent, for the serializer context.
+    """
+    params = {}
+    for name in ('fields', 'expand'):
+        value = request.query_params.get(name) if request.method in SAFE_METHODS else None
+        params[name] = None if value is None else [item for item in value.split(',') if item]
+    return params
+
+
+def select_fields(context, field_names, expandable=(), default_expand=()):
+    """
+    Returns the field names to render, in their declared order, and the set
+    of them to expand.
+    """
+    fields, expand = context.get('fields'), context.get('expand')
+    errors = {}
+    if fields is not None:
+        unknown = [name for name in fields if name not in field_names]
+        if unknown:
+            errors['fields'] = [f'Unknown field "{name}".' for name in unknown]
+    if expand is not None:
+        unknown = [name for name in expand if name not in expandable]
+        if unknown:
+            errors['expand'] = [f'"{name}" cannot be expanded.' for name in unknown]
+    if errors:
+        raise ValidationError(errors)
+
+    names = [name for name in field_names if fields is None or name in fields]
+    expanded = set(default_expand if expand is None else expand) & set(names)
+    return names, expanded
+
+
+class SparseFieldsetMixin:
+    """
+    Renders only the `?fields=` of the request and expands the `?expand=`
+    ones. `expandable_fields` maps a field to a factory of its expanded form,
+    or to None when the declared field is the expanded form and is left out
+    unless expanded.
+    """
+    expandable_fields = {}
+    default_expand = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names, expanded = select_fields(self.context, list(self.fields), self.expandable_fields, self.default_expand)
+        for name in list(self.fields):
+            factory = self.expandable_fields.get(name, False)
+            if name not in names or (factory is None and name not in expanded):
+                self.fields.pop(name)
+            elif factory and name in expanded:
+                self.fields[name] = factory()
@@ -1,12 +1,95 @@
-from django_filters.rest_framework import FilterSet
+from django.db.models import Case, Count, IntegerField, Value, When
+from django_filters.rest_framework import BaseInFilter, BooleanFilter, FilterSet, NumberFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import SearchFilter
 
 from store.models import Product
+from store.search import search_products
+
+
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
 
 
 class ProductFilter(FilterSet):
+    """
+    Every filter is a range or IN predicate on a bare indexed column, never a
+    function of one, so it can seek the index. Categories are matched on the
+    foreign key column without loading Category rows.
+    """
+    category = NumberFilter(field_name='category_id')
+    category__in = NumberInFilter(field_name='category_id', lookup_expr='in')
+    in_stock = BooleanFilter(method='filter_in_stock')
+
     class Meta:
         model = Product
         fields = {
             'inventory': ['lt', 'gte'],
+            'unit_price': ['gte', 'lte'],
+            'effective_price': ['lt', 'gte', 'lte'],
+            'datetime_created': ['gte', 'lte'],
+        }
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(inventory__gt=0) if value else queryset.filter(inventory__lte=0)
+
+
+class ProductSearchFilter(SearchFilter):
+    """`?search=` answered from the product token index instead of LIKE scans."""
+
+    def filter_queryset(self, request, queryset, view):
+        return search_products(queryset, ' '.join(self.get_search_terms(request)))
+
+
+# Lower bounds of the price facet buckets; the last bucket has no upper bound.
+PRICE_BUCKETS = [0, 10, 25, 50, 100, 250, 500, 1000]
+FACETS = ('category', 'price')
+
+
+def facet_params(request):
+    """The `?facets=` of the request, in the order of FACETS."""
+    value = request.query_params.get('facets')
+    if not value:
+        return []
+    names = [name for name in value.split(',') if name]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValidationError({'facets': [f'Unknown facet "{name}".' for name in unknown]})
+    return [name for name in FACETS if name in names]
+
+
+def facet_counts(queryset, facets):
+    """
+    Counts the products of `queryset` per category and/or per unit_price
+    bucket with a single grouped query.
+    """
+    bucket = Case(
+        *[When(unit_price__lt=upper, then=Value(index)) for index, upper in enumerate(PRICE_BUCKETS[1:])],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+    queryset, group_by = queryset.order_by(), []
+    if 'category' in facets:
+        group_by += ['category', 'category__title']
+    if 'price' in facets:
+        queryset, group_by = queryset.annotate(price_bucket=bucket), group_by + ['price_bucket']
+    rows = queryset.values(*group_by).annotate(count=Count('id'))
+
+    categories, buckets = {}, {}
+    for row in rows:
+        if 'category' in facets:
+            category = categories.setdefault(row['category'], {'id': row['category'], 'title': row['category__title'], 'count': 0})
+            category['count'] += row['count']
+        if 'price' in facets:
+            buckets[row['price_bucket']] = buckets.get(row['price_bucket'], 0) + row['count']
 
-        }
\ No newline at end of file
+    counts = {}
+    if 'category' in facets:
+        counts['category'] = sorted(categories.values(), key=lambda category: (-category['count'], category['id']))
+    if 'price' in facets:
+        bounds = PRICE_BUCKETS + [None]
+        counts['price'] = [
+            {'min': bounds[index], 'max': bounds[index + 1], 'count': buckets.get(index, 0)}
+            for index in range(len(PRICE_BUCKETS))
+        ]
+    return counts
@@ -0,0 +1,50 @@
+import time
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.db import connection, models
+
+
+@contextmanager
+def keep_timestamps(*model_classes):
+    """
+    Let bulk_create store the datetime_created/datetime_modified values set on
+    the instances instead of overwriting them with now().
+    """
+    fields = [
+        field for model in model_classes for field in model._meta.concrete_fields
+        if isinstance(field, models.DateField) and (field.auto_now or field.auto_now_add)
+    ]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def reset_sequences(*model_classes):
+    statements = connection.ops.sequence_reset_sql(no_style(), model_classes)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+class BulkWriter:
+    def __init__(self, stdout, batch_size):
+        self.stdout = stdout
+        self.batch_size = batch_size
+        self.stats = {}
+
+    def write(self, model, objs):
+        start = time.perf_counter()
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        rows, seconds = self.stats.get(model, (0, 0))
+        self.stats[model] = (rows + len(objs), seconds + time.perf_counter() - start)
+
+    def report(self):
+        for model, (rows, seconds) in self.stats.items():
+            rate = rows / seconds if seconds else 0
+            self.stdout.write(f"{model._meta.label:<24} {rows:>10} rows {seconds:>9.2f}s {rate:>12.0f} rows/s")
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from store import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a sized dataset, requests every store endpoint as each role and writes "
+        "query counts, rows fetched and p50/p95 latency to a JSON report. "
+        "The seeded rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark_endpoints.json')
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            seeded = benchmarks.seed(products=options['products'], orders=options['orders'])
+            results = benchmarks.run(seeded, repeat=options['repeat'])
+            transaction.set_rollback(True)
+
+        over_budget, failed = [], []
+        for endpoint in benchmarks.ENDPOINTS:
+            for role, result in results[endpoint.name].items():
+                flag = ''
+                if not 200 <= result['status'] < 300:
+                    failed.append(f"{endpoint.name} ({role}): HTTP {result['status']}")
+                    flag = '  failed'
+                elif result['queries'] > endpoint.max_queries:
+                    over_budget.append(f'{endpoint.name} ({role})')
+                    flag = f'  > {endpoint.max_queries} queries'
+                self.stdout.write(
+                    f"{endpoint.name:<22}{role:<10}{result['method']:<6}{result['status']:>4}{result['queries']:>4}q"
+                    f"{result['rows']:>6} rows{result['p50_ms']:>9.2f} ms p50{result['p95_ms']:>9.2f} ms p95{flag}"
+                )
+
+        report = {
+            'vendor': connection.vendor,
+            'products': options['products'],
+            'orders': options['orders'],
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        self.stdout.write(f"Report written to {options['output']}")
+        # A rejected request measures nothing, so such a run is not a valid report.
+        errors = []
+        if failed:
+            errors.append('Requests failed: ' + ', '.join(failed))
+        if over_budget:
+            errors.append('Over query budget: ' + ', '.join(over_budget))
+        if errors:
+            raise CommandError('\n'.join(errors))
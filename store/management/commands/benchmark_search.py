@@ -0,0 +1,53 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store.filters import ProductSearchFilter
+from store.models import Product
+from store.views import ProductViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares ?search= on the product token index with the LIKE based SearchFilter. "
+        "Seed a realistic catalog first, e.g. generate_fake_data --products 1000000."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', help="Search terms; sampled from product names when omitted.")
+        parser.add_argument('--samples', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        terms = options['terms'] or self.sample_terms(options['samples'])
+        view = ProductViewSet()
+        backends = [('LIKE scan', SearchFilter()), ('token index', ProductSearchFilter())]
+
+        self.stdout.write(f"{'term':<20}{'backend':<14}{'matches':>9}{'p50 ms':>10}{'max ms':>10}")
+        totals = {name: [] for name, _ in backends}
+        for term in terms:
+            request = Request(APIRequestFactory().get('/store/products/', {'search': term}))
+            for name, backend in backends:
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    # What the list endpoint runs: the page count and the first page.
+                    queryset = backend.filter_queryset(request, Product.objects.all(), view)
+                    count = queryset.count()
+                    list(queryset[:10])
+                    timings.append((time.perf_counter() - start) * 1000)
+                totals[name].extend(timings)
+                self.stdout.write(
+                    f"{term:<20}{name:<14}{count:>9}{statistics.median(timings):>10.2f}{max(timings):>10.2f}"
+                )
+        for name, timings in totals.items():
+            self.stdout.write(f"{name}: median {statistics.median(timings):.2f} ms over {len(timings)} runs")
+
+    def sample_terms(self, samples):
+        names = Product.objects.order_by('?').values_list('name', flat=True)[:samples]
+        return [random.choice(name.split())[:4].lower() for name in names if name.split()]
@@ -0,0 +1,60 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from store.models import Order, OrderItem, Product
+from store.serializers import (
+    OrderForAdminSerializer, OrderForAdminValuesSerializer, OrderForUserSerializer, OrderForUserValuesSerializer,
+    ProductSerializer, ProductValuesSerializer,
+)
+
+
+def orders():
+    return Order.objects.prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+    ).select_related('customer__user').order_by('id')
+
+
+CASES = [
+    ('products', lambda: Product.objects.order_by('id'), ProductSerializer, ProductValuesSerializer),
+    ('orders (user)', orders, OrderForUserSerializer, OrderForUserValuesSerializer),
+    ('orders (admin)', orders, OrderForAdminSerializer, OrderForAdminValuesSerializer),
+]
+
+
+class Command(BaseCommand):
+    help = "Times the model serializers of the list endpoints against their .values() counterparts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help="Rows serialized per run.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        for name, queryset, serializer_class, values_serializer_class in CASES:
+            def model_serializer():
+                return serializer_class(queryset()[:limit], many=True).data
+
+            def values_serializer():
+                reader = values_serializer_class()
+                rows = list(reader.get_values(queryset())[:limit])
+                return values_serializer_class(reader.prefetch(rows), many=True).data
+
+            same = JSONRenderer().render(model_serializer()) == JSONRenderer().render(values_serializer())
+            model_ms = self.time(model_serializer, options['repeat'])
+            values_ms = self.time(values_serializer, options['repeat'])
+            self.stdout.write(
+                f"{name:<16}model {model_ms:>9.2f} ms  values {values_ms:>9.2f} ms  "
+                f"speedup {model_ms / values_ms:>5.1f}x  identical output: {same}"
+            )
+
+    def time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            JSONRenderer().render(func())
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
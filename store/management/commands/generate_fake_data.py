@@ -1,33 +1,25 @@
 import random
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from multiprocessing import Pool
+
 from faker import Faker
-from datetime import datetime, timedelta
-import factory
-from factory.fuzzy import FuzzyDateTime
 
-from django.db import transaction
-from django.utils import timezone
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
-from django.utils.timezone import make_aware
-from django.utils.timezone import get_current_timezone
-from config import settings
+from django.db.models import Max
 
 from store.models import Address, Cart, CartItem, Category, Comment, Order, OrderItem, Product, Discount, Customer
-from store.factories import (
-    CartFactory,
-    CategoryFactory,
-    CommentFactory,
-    OrderItemFactory,
-    ProductFactory,
-    DiscountFactory,
-    CustomerFactory,
-    AddressFactory,
-    OrderFactory,
-    CartItemFactory,
-)
+from store import pricing, rollups, search
+from ._bulk import BulkWriter, keep_timestamps, reset_sequences
 
 faker = Faker()
 
-list_of_models = [CartItem, Cart, OrderItem, Order, Product, Category, Comment, Discount, Address, Customer]
+list_of_models = [CartItem, Cart, OrderItem, Order, Comment, Product, Category, Discount, Address, Customer]
+
+FAKE_USERNAME_PREFIX = 'fake-customer-'
 
 NUM_CATEGORIES = 100
 NUM_DISCOUNTS = 10
@@ -35,102 +27,231 @@ NUM_PRODUCTS = 1000
 NUM_CUSTOMERS = 100
 NUM_ORDERS = 30
 NUM_CARTS = 100
+BATCH_SIZE = 1000
+
+
+def random_datetime():
+    return datetime(random.randrange(2019, 2023), random.randint(1, 12), random.randint(1, 12), tzinfo=dt_timezone.utc)
+
+
+def fake_product_texts(args):
+    """Names, descriptions and comment bodies for one batch of products; runs in a worker process."""
+    count, seed = args
+    fake = Faker()
+    fake.seed_instance(seed)
+    names = [' '.join(word.capitalize() for word in fake.words(3)) for _ in range(count)]
+    descriptions = [fake.paragraph(nb_sentences=5, variable_nb_sentences=True) for _ in range(count)]
+    comments = [
+        [fake.paragraph(nb_sentences=3, variable_nb_sentences=True) for _ in range(fake.random_int(1, 5))]
+        for _ in range(count)
+    ]
+    return names, descriptions, comments
+
+
+def batches(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield start, min(batch_size, total - start)
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
 
 
 class Command(BaseCommand):
     help = "Generates fake data"
 
-    @transaction.atomic
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=NUM_CATEGORIES)
+        parser.add_argument('--discounts', type=int, default=NUM_DISCOUNTS)
+        parser.add_argument('--products', type=int, default=NUM_PRODUCTS)
+        parser.add_argument('--customers', type=int, default=NUM_CUSTOMERS)
+        parser.add_argument('--orders', type=int, default=NUM_ORDERS)
+        parser.add_argument('--carts', type=int, default=NUM_CARTS)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help="Processes generating product texts with Faker; 0 generates them in this process.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.writer = BulkWriter(self.stdout, batch_size)
+
         self.stdout.write("Deleting old data...")
-        models = list_of_models
-        for m in models:
+        for m in list_of_models:
             m.objects.all().delete()
+        get_user_model().objects.filter(username__startswith=FAKE_USERNAME_PREFIX).delete()
 
         self.stdout.write("Creating new data...\n")
+        with keep_timestamps(Product, Order, Comment):
+            category_ids = self.create_categories(options['categories'])
+            discount_ids = self.create_discounts(options['discounts'])
+            product_prices = self.create_products(options['products'], batch_size, options['workers'], category_ids, discount_ids)
+            customer_ids = self.create_customers(options['customers'], batch_size)
+            self.create_orders(options['orders'], batch_size, customer_ids, product_prices)
+            self.create_carts(options['carts'], batch_size, product_prices)
 
-        tz = timezone.get_current_timezone()
-
-        # Categories data
-        print(f"Adding {NUM_CATEGORIES} categories...", end='')
-        all_categories = [CategoryFactory(top_product=None) for _ in range(NUM_CATEGORIES)]
+        reset_sequences(get_user_model(), *list_of_models)
+        print("Computing effective prices...", end='')
+        pricing.refresh_effective_prices(Product.objects.all())
+        Cart.objects.refresh_totals()
+        Product.objects.refresh_comment_stats()
         print('DONE')
-
-        # Discounts data
-        print(f"Adding {NUM_DISCOUNTS} discounts...", end='')
-        all_discounts = [DiscountFactory() for _ in range(NUM_DISCOUNTS)]
-        print('DONE')
-
-        # Products data
-        print(f"Adding {NUM_PRODUCTS} product...", end='')
-        all_products = list()
-        for _ in range(NUM_PRODUCTS):
-            new_product = ProductFactory(category_id=random.choice(all_categories).id)
-            new_product.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-            new_product.datetime_modified = new_product.datetime_created + timedelta(hours=random.randint(1, 500))
-            new_product.save()
-            all_products.append(new_product)
+        print("Indexing products for search...", end='')
+        search.rebuild_index()
         print('DONE')
-
-        # Customers data
-        print(f"Adding {NUM_CUSTOMERS} customers...", end='')
-        all_customers = [(CustomerFactory() if (random.random() > 0.3) else CustomerFactory(birth_date=None)) for _ in range(NUM_CUSTOMERS) ]
+        print("Rebuilding sales rollups...", end='')
+        rollups.rebuild()
         print('DONE')
+        self.writer.report()
 
-        # Addresses data
-        print(f"Adding customers addresses...", end='')
-        all_addresses = [
-            AddressFactory(customer_id=customer.id) for customer in all_customers
-        ]
+    def create_categories(self, count):
+        print(f"Adding {count} categories...", end='')
+        first_id = next_id(Category)
+        self.writer.write(Category, [
+            Category(
+                id=first_id + i,
+                title=faker.sentence(nb_words=5, variable_nb_words=True),
+                description=faker.paragraph(nb_sentences=1, variable_nb_sentences=False),
+            ) for i in range(count)
+        ])
         print('DONE')
+        return list(range(first_id, first_id + count))
 
-        # Orders data
-        print(f"Adding {NUM_ORDERS} orders...", end='')
-        all_orders = [OrderFactory(
-            customer_id=random.choice(all_customers).id
-        ) for _ in range(NUM_ORDERS)]
-        for order in all_orders:
-            order.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-            order.save()
+    def create_discounts(self, count):
+        print(f"Adding {count} discounts...", end='')
+        first_id = next_id(Discount)
+        self.writer.write(Discount, [
+            Discount(
+                id=first_id + i,
+                discount=random.randint(1, 80) / 100,
+                description=faker.paragraph(nb_sentences=1, variable_nb_sentences=False),
+            ) for i in range(count)
+        ])
         print('DONE')
+        return list(range(first_id, first_id + count))
 
-        # OrderItems data
-        print(f"Adding order items...", end='')
-        all_order_items = list()
-        for order in all_orders:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                order_item = OrderItemFactory(
-                    order_id=order.id,
-                    product_id=product.id,
-                    unit_price=product.unit_price,
-                )
-                all_order_items.append(order_item)
+    def create_products(self, count, batch_size, workers, category_ids, discount_ids):
+        """Returns {product id: unit price} for the order and cart items."""
+        print(f"Adding {count} products with comments...", end='')
+        first_id = next_id(Product)
+        product_prices = {}
+        tasks = [(size, random.getrandbits(32)) for _, size in batches(count, batch_size)]
+        pool = Pool(workers) if workers else None
+        texts = pool.imap(fake_product_texts, tasks) if pool else map(fake_product_texts, tasks)
+        try:
+            for (start, size), (names, descriptions, comments) in zip(batches(count, batch_size), texts):
+                products, product_discounts, product_comments = [], [], []
+                for i in range(size):
+                    product_id = first_id + start + i
+                    datetime_created = random_datetime()
+                    product = Product(
+                        id=product_id,
+                        name=names[i],
+                        slug='-'.join(names[i].split(' ')).lower(),
+                        category_id=random.choice(category_ids),
+                        description=descriptions[i],
+                        unit_price=Decimal(random.randint(100, 100000)) / 100,
+                        inventory=random.randint(1, 100),
+                        datetime_created=datetime_created,
+                        datetime_modified=datetime_created + timedelta(hours=random.randint(1, 500)),
+                    )
+                    products.append(product)
+                    product_prices[product_id] = product.unit_price
+                    if discount_ids and random.random() < 0.2:
+                        product_discounts.append(Product.discounts.through(
+                            product_id=product_id, discount_id=random.choice(discount_ids),
+                        ))
+                    for body in comments[i]:
+                        product_comments.append(Comment(
+                            product_id=product_id,
+                            name=faker.first_name(),
+                            body=body,
+                            datetime_created=random_datetime(),
+                            status=random.choice([Comment.COMMENT_STATUS_WAITING, Comment.COMMENT_STATUS_APPROVED, Comment.COMMENT_STATUS_NOT_APPROVED]),
+                        ))
+                self.writer.write(Product, products)
+                self.writer.write(Product.discounts.through, product_discounts)
+                self.writer.write(Comment, product_comments)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
         print('DONE')
+        return product_prices
 
-        # Comments data
-        print(f"Adding product comments...", end='')
-        for product in all_products:
-            for _ in range(random.randint(1, 5)):
-                comment = CommentFactory(product_id=product.id)
-                comment.datetime_created = datetime(random.randrange(2019, 2023), random.randint(1,12),random.randint(1, 12), tzinfo=timezone.utc)
-                comment.save()
+    def create_customers(self, count, batch_size):
+        print(f"Adding {count} customers with addresses...", end='')
+        User = get_user_model()
+        first_user_id = next_id(User)
+        first_id = next_id(Customer)
+        password = make_password(None)
+        for start, size in batches(count, batch_size):
+            users, customers, addresses = [], [], []
+            for i in range(start, start + size):
+                users.append(User(
+                    id=first_user_id + i,
+                    username=f'{FAKE_USERNAME_PREFIX}{first_user_id + i}',
+                    email=f'{FAKE_USERNAME_PREFIX}{first_user_id + i}@example.com',
+                    first_name=faker.first_name(),
+                    last_name=faker.last_name(),
+                    password=password,
+                ))
+                customers.append(Customer(
+                    id=first_id + i,
+                    user_id=first_user_id + i,
+                    phone_number=faker.phone_number(),
+                    birth_date=faker.date_between(datetime(1990, 1, 1), datetime(2015, 1, 1)) if random.random() > 0.3 else None,
+                ))
+                addresses.append(Address(
+                    customer_id=first_id + i,
+                    province=faker.word(),
+                    city=faker.word(),
+                    street=f'street {random.randint(1, 50)}',
+                ))
+            self.writer.write(User, users)
+            self.writer.write(Customer, customers)
+            self.writer.write(Address, addresses)
         print('DONE')
+        return list(range(first_id, first_id + count))
 
-        # Carts data
-        print(f"Adding {NUM_CARTS} carts...", end='')
-        all_carts = [CartFactory() for _ in range(NUM_CARTS)]
+    def create_orders(self, count, batch_size, customer_ids, product_prices):
+        print(f"Adding {count} orders with items...", end='')
+        first_id = next_id(Order)
+        product_ids = list(product_prices)
+        for start, size in batches(count, batch_size):
+            orders, order_items = [], []
+            for order_id in range(first_id + start, first_id + start + size):
+                orders.append(Order(
+                    id=order_id,
+                    customer_id=random.choice(customer_ids),
+                    datetime_created=random_datetime(),
+                    status=random.choice([Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED]),
+                ))
+                for product_id in random.sample(product_ids, min(random.randint(1, 10), len(product_ids))):
+                    order_items.append(OrderItem(
+                        order_id=order_id,
+                        product_id=product_id,
+                        unit_price=product_prices[product_id],
+                        quantity=random.randint(1, 20),
+                    ))
+            self.writer.write(Order, orders)
+            self.writer.write(OrderItem, order_items)
         print('DONE')
 
-        # CartItems data
-        print(f"Adding cart items...", end='')
-        all_cart_items = list()
-        for cart in all_carts:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                cart_item = CartItemFactory(
-                    cart_id=cart.id,
-                    product_id=product.id,
-                )
-                all_cart_items.append(cart_item)
+    def create_carts(self, count, batch_size, product_prices):
+        print(f"Adding {count} carts with items...", end='')
+        product_ids = list(product_prices)
+        for start, size in batches(count, batch_size):
+            carts, cart_items = [], []
+            for _ in range(size):
+                cart = Cart(id=uuid.uuid4(), items_count=0, total_price=0)
+                for product_id in random.sample(product_ids, min(random.randint(1, 10), len(product_ids))):
+                    quantity = random.randint(1, 20)
+                    cart_items.append(CartItem(cart_id=cart.id, product_id=product_id, quantity=quantity))
+                    cart.items_count += quantity
+                    cart.total_price += quantity * product_prices[product_id]
+                carts.append(cart)
+            self.writer.write(Cart, carts)
+            self.writer.write(CartItem, cart_items)
         print('DONE')
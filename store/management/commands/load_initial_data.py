@@ -0,0 +1,200 @@
+import re
+from uuid import UUID
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DateTimeField, Max
+from django.utils import timezone
+
+from store.models import Cart, Comment, Customer, Order, Product
+from store import pricing, rollups, search
+from ._bulk import BulkWriter, keep_timestamps, reset_sequences
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 1 << 16
+
+TOKEN = re.compile(r"\s+|--[^\n]*\n|'(?:[^'\\]|\\.|'')*'|[(),;]|[^\s(),;']+")
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
+
+
+def tokenize(stream):
+    """Yields SQL tokens reading `stream` a chunk at a time."""
+    buffer = ''
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            match = TOKEN.match(buffer, position)
+            if not match:
+                break
+            token = match.group()
+            # A token reaching the end of the buffer may continue in the next
+            # chunk, and a string followed by a quote is cut inside a '' escape.
+            if chunk and (match.end() == len(buffer) or token[0] == "'" == buffer[match.end()]):
+                break
+            position = match.end()
+            if not token.isspace() and not token.startswith('--'):
+                yield token
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise CommandError(f'Unexpected input near {buffer[:50]!r}')
+            return
+
+
+def literal(token):
+    if token.startswith("'"):
+        return re.sub(r"''|\\(.)", lambda m: "'" if m.group() == "''" else ESCAPES.get(m.group(1), m.group(1)), token[1:-1])
+    if token.lower() == 'null':
+        return None
+    return token
+
+
+def expect(tokens, *expected):
+    for value in expected:
+        token = next(tokens, None)
+        if token is None or token.lower() != value:
+            raise CommandError(f'Expected {value!r} but found {token!r}')
+
+
+def parenthesized(tokens):
+    values = []
+    for token in tokens:
+        if token == ')':
+            return values
+        if token != ',':
+            values.append(token)
+    raise CommandError('Unterminated parenthesis')
+
+
+def statements(tokens):
+    """Yields (table, columns, rows) for each `INSERT INTO ... VALUES ...;` statement."""
+    for token in tokens:
+        if token.lower() != 'insert':
+            raise CommandError(f'Only INSERT statements are supported, found {token!r}')
+        expect(tokens, 'into')
+        table = next(tokens).strip('`"')
+        expect(tokens, '(')
+        columns = [column.strip('`"') for column in parenthesized(tokens)]
+        expect(tokens, 'values')
+        yield table, columns, rows(tokens)
+
+
+def rows(tokens):
+    for token in tokens:
+        if token == '(':
+            yield [literal(value) for value in parenthesized(tokens)]
+        elif token == ';':
+            return
+        elif token != ',':
+            raise CommandError(f'Unexpected {token!r} between rows')
+
+
+def cart_uuid(value):
+    # Carts were keyed by integers before they moved to UUID primary keys.
+    return UUID(int=int(value))
+
+
+class Command(BaseCommand):
+    help = "Loads the database_initial.sql fixtures into the store tables on any database backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(settings.BASE_DIR / 'database_initial.sql'))
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.writer = BulkWriter(self.stdout, self.batch_size)
+        self.models = {model._meta.db_table: model for model in apps.get_models(include_auto_created=True)}
+        self.password = make_password(None)
+        self.emails = set()
+
+        with open(options['path'], encoding='utf-8') as stream, keep_timestamps(Product, Order, Comment, Cart):
+            for table, columns, table_rows in statements(tokenize(stream)):
+                self.stdout.write(f"Loading {table}...")
+                with transaction.atomic():
+                    self.load(table, columns, table_rows)
+
+        self.stdout.write("Computing effective prices...")
+        pricing.refresh_effective_prices(Product.objects.all())
+        Product.objects.refresh_comment_stats()
+        Cart.objects.refresh_totals()
+        reset_sequences(get_user_model(), *self.writer.stats)
+        self.stdout.write("Indexing products for search...")
+        search.rebuild_index()
+        self.stdout.write("Rebuilding sales rollups...")
+        rollups.rebuild()
+        self.writer.report()
+
+    def load(self, table, columns, table_rows):
+        if table not in self.models:
+            raise CommandError(f'Unknown table {table}')
+        build = getattr(self, f'build_{table}', self.build_row)
+        pending = {}
+        for row in table_rows:
+            for obj in build(self.models[table], dict(zip(columns, row))):
+                batch = pending.setdefault(type(obj), [])
+                batch.append(obj)
+                if len(batch) >= self.batch_size:
+                    self.flush(pending)
+        self.flush(pending)
+
+    def flush(self, pending):
+        # Dicts keep insertion order, so parents are written before their children.
+        for model, objs in pending.items():
+            if objs:
+                self.writer.write(model, objs)
+                objs.clear()
+
+    def build_row(self, model, values):
+        return [model(**self.to_python(model, values))]
+
+    def to_python(self, model, values):
+        converted = {}
+        for column, value in values.items():
+            field = model._meta.get_field(column)
+            value = field.to_python(value)
+            if isinstance(field, DateTimeField) and value is not None and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            converted[field.attname] = value
+        return converted
+
+    def build_store_customer(self, model, values):
+        User = get_user_model()
+        if not hasattr(self, 'next_user_id'):
+            self.next_user_id = (User.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        user_id = self.next_user_id
+        self.next_user_id += 1
+
+        email = values.pop('email')
+        if email in self.emails:
+            local, domain = email.split('@', 1)
+            email = f"{local}+{values['id']}@{domain}"
+        self.emails.add(email)
+        user = User(
+            id=user_id,
+            username=f"customer-{values['id']}",
+            email=email,
+            first_name=values.pop('first_name'),
+            last_name=values.pop('last_name'),
+            password=self.password,
+        )
+        return [user, Customer(user_id=user_id, **self.to_python(model, values))]
+
+    def build_store_cart(self, model, values):
+        values['id'] = cart_uuid(values['id'])
+        return self.build_row(model, values)
+
+    def build_store_cartitem(self, model, values):
+        values['cart_id'] = cart_uuid(values['cart_id'])
+        return self.build_row(model, values)
+
+    def build_store_discount(self, model, values):
+        # The fixtures give percentages; discounts are stored as fractions.
+        values['discount'] = float(values['discount']) / 100
+        return self.build_row(model, values)
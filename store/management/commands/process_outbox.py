@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = "Dispatches pending outbox events (e.g. order_created) to their signal receivers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=2, help="Seconds before the first retry, doubled on every attempt.")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to sleep when there is nothing to do.")
+        parser.add_argument('--once', action='store_true', help="Drain the outbox once and exit.")
+
+    def handle(self, *args, **options):
+        with outbox.make_executor(options['workers']) as executor:
+            while True:
+                done, failed = outbox.process_batch(
+                    executor,
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts'],
+                    backoff=options['backoff'],
+                )
+                if done or failed:
+                    self.stdout.write(f"{done} events dispatched, {failed} failed")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
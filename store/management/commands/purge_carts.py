@@ -0,0 +1,51 @@
+import argparse
+import re
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import carts
+
+UNITS = {'d': 'days', 'h': 'hours', 'm': 'minutes'}
+
+
+def age(value):
+    match = re.fullmatch(r'(\d+)([dhm])', value)
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid age "{value}", use e.g. 30d, 12h or 45m.')
+    return timedelta(**{UNITS[match[2]]: int(match[1])})
+
+
+class Command(BaseCommand):
+    help = "Deletes carts, with their items, that had no item change for longer than --older-than"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=age, default='30d', help="Inactivity after which a cart expires, e.g. 30d, 12h or 45m (default: 30d).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Carts deleted per transaction.")
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+        parser.add_argument('--every', type=float, help="Keep running, purging every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.purge(options)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def purge(self, options):
+        start = time.perf_counter()
+        total_carts = total_items = 0
+        before = timezone.now() - options['older_than']
+        for cart_count, item_count in carts.purge_expired(before, options['batch_size'], options['pause']):
+            total_carts += cart_count
+            total_items += item_count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Deleted {cart_count} carts and {item_count} items")
+        elapsed = time.perf_counter() - start
+        rows = total_carts + total_items
+        self.stdout.write(
+            f"Deleted {total_carts} carts and {total_items} items inactive since {before:%Y-%m-%d %H:%M} "
+            f"in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)"
+        )
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import search
+from store.models import ProductSearchToken
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search token index from scratch"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        search.rebuild_index()
+        self.stdout.write(
+            f"Indexed {ProductSearchToken.objects.count()} tokens in {time.perf_counter() - start:.2f}s"
+        )
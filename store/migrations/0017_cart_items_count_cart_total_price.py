@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.update(
+        items_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')[:1]), 0),
+        total_price=Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('product__unit_price'))).values('total')[:1]),
+            0,
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_alter_cartitem_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
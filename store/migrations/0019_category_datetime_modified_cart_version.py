@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='datetime_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+
+def index_products(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductSearchToken = apps.get_model('store', 'ProductSearchToken')
+    tokens = []
+    for product_id, name, category_title in Product.objects.values_list('id', 'name', 'category__title').iterator():
+        weights = {}
+        for text, weight in ((name, 3), (category_title or '', 1)):
+            for token in re.findall(r'\w+', text.lower()):
+                weights[token[:64]] = weights.get(token[:64], 0) + weight
+        tokens.extend(
+            ProductSearchToken(product_id=product_id, token=token, weight=weight)
+            for token, weight in weights.items()
+        )
+        if len(tokens) >= 1000:
+            ProductSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    ProductSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_category_datetime_modified_cart_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='store.product')),
+            ],
+            options={
+                'unique_together': {('token', 'product')},
+            },
+        ),
+        migrations.RunPython(index_products, migrations.RunPython.noop),
+    ]
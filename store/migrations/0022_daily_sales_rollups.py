@@ -0,0 +1,73 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    # Orders placed before the rollups existed; later status changes move
+    # them between these rows.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    items = OrderItem.objects.annotate(day=TruncDate('order__datetime_created'))
+    for model, key, path in [
+        (apps.get_model('store', 'ProductDailySales'), 'product', 'product'),
+        (apps.get_model('store', 'CategoryDailySales'), 'category', 'product__category'),
+    ]:
+        rows = items.values(path, 'day', 'order__status').order_by().annotate(
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('unit_price')),
+            orders=Count('order', distinct=True),
+        )
+        model.objects.bulk_create([
+            model(
+                **{f'{key}_id': row[path]}, day=row['day'], status=row['order__status'],
+                units=row['units'], revenue=row['revenue'], orders=row['orders'],
+            ) for row in rows.iterator()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_api_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('p', 'Paid'), ('u', 'Unpaid'), ('c', 'Canceled')], max_length=1)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product daily sales',
+                'indexes': [models.Index(fields=['day'], name='store_product_sales_day_idx')],
+                'unique_together': {('product', 'day', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('p', 'Paid'), ('u', 'Unpaid'), ('c', 'Canceled')], max_length=1)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.category')),
+            ],
+            options={
+                'verbose_name_plural': 'category daily sales',
+                'indexes': [models.Index(fields=['day'], name='store_category_sales_day_idx')],
+                'unique_together': {('category', 'day', 'status')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:08
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_effective_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    products = []
+    rows = Product.objects.annotate(best_discount=Max('discounts__discount')) \
+        .values_list('id', 'unit_price', 'best_discount')
+    for product_id, unit_price, discount in rows.iterator():
+        discount = min(max(Decimal(str(discount or 0)), Decimal(0)), Decimal(1))
+        price = (unit_price * (1 - discount) * Decimal('1.09')).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        products.append(Product(id=product_id, effective_price=price))
+    Product.objects.bulk_update(products, ['effective_price'], batch_size=1000)
+
+    # Cart totals are now in effective prices.
+    items = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.update(total_price=Coalesce(
+        Subquery(items.annotate(total=Sum(F('quantity') * F('product__effective_price'))).values('total')[:1]),
+        0,
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='store_product_eff_price_idx'),
+        ),
+        migrations.RunPython(fill_effective_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['datetime_created', 'id'], name='store_product_created_idx'),
+        ),
+    ]
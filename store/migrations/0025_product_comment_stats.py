@@ -0,0 +1,36 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:13
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_stats(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Comment = apps.get_model('store', 'Comment')
+    approved = Comment.objects.filter(product=OuterRef('pk'), status='a').order_by().values('product')
+    Product.objects.update(
+        approved_comment_count=Coalesce(Subquery(approved.annotate(count=Count('id')).values('count')[:1]), 0),
+        last_comment_at=Subquery(approved.annotate(last=Max('datetime_created')).values('last')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_product_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_comment_stats, migrations.RunPython.noop),
+    ]
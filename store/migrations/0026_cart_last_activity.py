@@ -0,0 +1,31 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_last_activity(apps, schema_editor):
+    # Item changes were not tracked so far; creation is the last known activity.
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_activity=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_product_comment_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_last_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['last_activity'], name='store_cart_last_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:57
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from store.pricing import effective_price
+
+
+def discounts_to_fractions(apps, schema_editor):
+    # Discounts are the fraction of the price taken off, but percentages
+    # (42.65 for 42.65% off) were loaded too, and priced as 100% off.
+    Discount = apps.get_model('store', 'Discount')
+    Product = apps.get_model('store', 'Product')
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    percentages = Discount.objects.filter(discount__gt=1)
+    products = list(Product.objects.filter(discounts__in=percentages).values_list('pk', flat=True).distinct())
+    if not products:
+        return
+    percentages.update(discount=F('discount') / 100)
+
+    rows = Product.objects.filter(pk__in=products).annotate(best_discount=Max('discounts__discount'))
+    Product.objects.bulk_update([
+        Product(id=row.id, effective_price=effective_price(row.unit_price, row.best_discount)) for row in rows
+    ], ['effective_price'], batch_size=1000)
+
+    items = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.filter(items__product__in=products).update(
+        total_price=Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('product__effective_price'))).values('total')[:1]),
+            0,
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        version=F('version') + 1,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_cart_last_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(discounts_to_fractions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='discount',
+            name='discount',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+        migrations.AddConstraint(
+            model_name='discount',
+            constraint=models.CheckConstraint(check=models.Q(('discount__gte', 0), ('discount__lte', 1)), name='store_discount_fraction'),
+        ),
+    ]
@@ -1,13 +1,17 @@
-from django.db import models
-from django.core.validators import MinValueValidator
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.core.validators import MaxValueValidator, MinValueValidator
 from uuid import uuid4
 from django.conf import settings
+from django.utils import timezone
 
 
 class Category(models.Model):
     title = models.CharField(max_length=255)
     description = models.CharField(max_length=500, blank=True)
     top_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, blank=True,related_name='+')
+    datetime_modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'category'
@@ -18,13 +22,28 @@ class Category(models.Model):
 
 
 class Discount(models.Model):
-    discount = models.FloatField()
+    # The fraction of the unit price taken off: 0.25 is 25% off.
+    discount = models.FloatField(validators=[MinValueValidator(0), MaxValueValidator(1)])
     description = models.CharField(max_length=255)
-    
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(discount__gte=0, discount__lte=1), name='store_discount_fraction'),
+        ]
+
     def __str__(self):
         return f'{self.discount} | {self.description}'
 
 
+class ProductQuerySet(models.QuerySet):
+    def refresh_comment_stats(self):
+        approved = Comment.approved.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.update(
+            approved_comment_count=Coalesce(Subquery(approved.annotate(count=Count('id')).values('count')[:1]), 0),
+            last_comment_at=Subquery(approved.annotate(last=Max('datetime_created')).values('last')[:1]),
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -33,13 +52,39 @@ class Product(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
     discounts = models.ManyToManyField(Discount, blank=True, related_name='products')
+    # unit_price after the best discount and tax, kept up to date by store.pricing.
+    effective_price = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
+    # Of the approved comments, kept up to date by the Comment signal handlers.
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_modified = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'unit_price', 'id'], name='store_product_cat_price_idx'),
+            models.Index(fields=['unit_price', 'id'], name='store_product_price_idx'),
+            models.Index(fields=['name', 'id'], name='store_product_name_idx'),
+            models.Index(fields=['inventory', 'id'], name='store_product_inventory_idx'),
+            models.Index(fields=['effective_price', 'id'], name='store_product_eff_price_idx'),
+            models.Index(fields=['datetime_created', 'id'], name='store_product_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class ProductSearchToken(models.Model):
+    token = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = [['token', 'product']]
+
+
 class Customer(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
     phone_number = models.CharField(max_length=255)
@@ -85,6 +130,12 @@ class Order(models.Model):
     objects = models.Manager()
     unpaid_orders = UnpaidOrderManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'datetime_created'], name='store_order_customer_idx'),
+            models.Index(fields=['status', 'datetime_created'], name='store_order_status_idx'),
+        ]
+
     def __str__(self):
         return f'order id: {self.id}'
 
@@ -128,10 +179,136 @@ class Comment(models.Model):
     objects = CommentManager()
     approved = ApprovedCommentManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'status', 'datetime_created'], name='store_comment_product_idx'),
+        ]
+
+
+class CartQuerySet(models.QuerySet):
+    def add_to_totals(self, quantity, amount):
+        # Called on every item change, so it also marks the cart as active.
+        return self.update(
+            items_count=F('items_count') + quantity,
+            total_price=F('total_price') + amount,
+            version=F('version') + 1,
+            last_activity=timezone.now(),
+        )
+
+    def lock(self):
+        """
+        Locks the carts with SELECT ... FOR UPDATE and returns their ids. Take
+        the cart lock before any lock on its items.
+        """
+        return list(self.select_for_update().values_list('pk', flat=True))
+
+    def expired(self, before):
+        return self.filter(last_activity__lt=before)
+
+    def refresh_totals(self):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+        return self.update(
+            items_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')[:1]), 0),
+            total_price=Coalesce(
+                Subquery(items.annotate(total=Sum(F('quantity') * F('product__effective_price'))).values('total')[:1]),
+                0,
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            version=F('version') + 1,
+        )
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_activity = models.DateTimeField(default=timezone.now)
+    items_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    version = models.PositiveIntegerField(default=1)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_activity'], name='store_cart_last_activity_idx'),
+        ]
+
+
+class CartItemManager(models.Manager):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Insert the (cart, product) line or increase its quantity in a single
+        statement, so concurrent adds to the same line never lose increments.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        if connection.vendor == 'mysql':
+            return self._upsert_on_duplicate_key(using, cart_id, product_id, quantity)
+        if connection.features.supports_update_conflicts_with_target \
+                and connection.features.can_return_columns_from_insert:
+            return self._upsert_on_conflict(using, cart_id, product_id, quantity)
+        return self._upsert_with_update(using, cart_id, product_id, quantity)
+
+    def _insert_params(self, connection, cart_id, product_id, quantity):
+        opts = self.model._meta
+        columns = [opts.get_field(name).column for name in ('cart', 'product', 'quantity')]
+        params = [
+            opts.get_field('cart').get_db_prep_value(cart_id, connection),
+            product_id,
+            quantity,
+        ]
+        return opts.db_table, columns, params
+
+    def _upsert_on_duplicate_key(self, using, cart_id, product_id, quantity):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table, (cart, product, quantity_column), params = self._insert_params(connection, cart_id, product_id, quantity)
+        pk = qn(self.model._meta.pk.column)
+        # VALUES() is deprecated since MySQL 8.0.20 in favour of a row alias,
+        # which MariaDB and older MySQL versions do not support.
+        if connection.mysql_is_mariadb or connection.mysql_version < (8, 0, 19):
+            alias, inserted = '', f'VALUES({qn(quantity_column)})'
+        else:
+            alias, inserted = ' AS new', f'new.{qn(quantity_column)}'
+        sql = (
+            f'INSERT INTO {qn(table)} ({qn(cart)}, {qn(product)}, {qn(quantity_column)}) VALUES (%s, %s, %s){alias} '
+            f'ON DUPLICATE KEY UPDATE {pk} = LAST_INSERT_ID({pk}), '
+            f'{qn(quantity_column)} = {qn(quantity_column)} + {inserted}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            pk_value = cursor.lastrowid
+        return self.using(using).get(pk=pk_value)
+
+    def _upsert_on_conflict(self, using, cart_id, product_id, quantity):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table, (cart, product, quantity_column), params = self._insert_params(connection, cart_id, product_id, quantity)
+        pk = self.model._meta.pk.column
+        sql = (
+            f'INSERT INTO {qn(table)} ({qn(cart)}, {qn(product)}, {qn(quantity_column)}) VALUES (%s, %s, %s) '
+            f'ON CONFLICT ({qn(cart)}, {qn(product)}) DO UPDATE '
+            f'SET {qn(quantity_column)} = {qn(table)}.{qn(quantity_column)} + excluded.{qn(quantity_column)} '
+            f'RETURNING {qn(pk)}, {qn(quantity_column)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            pk_value, quantity_value = cursor.fetchone()
+        return self.model.from_db(
+            using,
+            [pk, 'cart_id', 'product_id', 'quantity'],
+            [pk_value, self.model._meta.get_field('cart').to_python(cart_id), product_id, quantity_value],
+        )
+
+    def _upsert_with_update(self, using, cart_id, product_id, quantity):
+        lines = self.using(using).filter(cart_id=cart_id, product_id=product_id)
+        if not lines.update(quantity=F('quantity') + quantity):
+            try:
+                with transaction.atomic(using=using):
+                    return self.using(using).create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            except IntegrityError:
+                lines.update(quantity=F('quantity') + quantity)
+        return lines.get()
 
 
 class CartItem(models.Model):
@@ -139,5 +316,72 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='cart_items')
     quantity = models.SmallIntegerField(default=1)
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = [['cart', 'product']]
+
+
+class OutboxEvent(models.Model):
+    STATUS_PENDING = 'p'
+    STATUS_DONE = 'd'
+    STATUS_FAILED = 'f'
+    STATUS = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUS, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='store_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event} #{self.id}'
+
+
+class DailySales(models.Model):
+    """
+    Units, revenue and number of orders of one day and order status, kept
+    up to date by store.rollups.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=1, choices=Order.ORDER_STATUS)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductDailySales(DailySales):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = 'product daily sales'
+        unique_together = [['product', 'day', 'status']]
+        indexes = [
+            models.Index(fields=['day'], name='store_product_sales_day_idx'),
+        ]
+
+
+class CategoryDailySales(DailySales):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = 'category daily sales'
+        unique_together = [['category', 'day', 'status']]
+        indexes = [
+            models.Index(fields=['day'], name='store_category_sales_day_idx'),
+        ]
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from store.models import Order, OutboxEvent
+from store.signals import order_created
+
+
+def _order_created(payload):
+    return order_created, {'sender': Order, 'order': Order.objects.get(pk=payload['order_id'])}
+
+
+EVENT_HANDLERS = {
+    'order_created': _order_created,
+}
+
+
+def publish(event, **payload):
+    """
+    Record an event to be dispatched by `manage.py process_outbox`. Call it
+    inside the transaction that makes the change, so both commit together.
+    """
+    return OutboxEvent.objects.create(event=event, payload=payload)
+
+
+def dispatch(event):
+    signal, kwargs = EVENT_HANDLERS[event.event](event.payload)
+    for receiver, response in signal.send_robust(**kwargs):
+        if isinstance(response, Exception):
+            raise response
+
+
+def claim_events(batch_size, lease):
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEvent.STATUS_PENDING, available_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        # Hide the claimed events from other workers; if this worker dies they
+        # become available again once the lease runs out.
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]) \
+            .update(available_at=now + lease)
+    return events
+
+
+def process_event(event, max_attempts, backoff, max_backoff):
+    try:
+        dispatch(event)
+    except Exception as error:
+        attempts = event.attempts + 1
+        delay = min(backoff * 2 ** (attempts - 1), max_backoff)
+        OutboxEvent.objects.filter(pk=event.pk).update(
+            attempts=attempts,
+            status=OutboxEvent.STATUS_FAILED if attempts >= max_attempts else OutboxEvent.STATUS_PENDING,
+            available_at=timezone.now() + timedelta(seconds=delay),
+            last_error=repr(error),
+        )
+        return False
+    else:
+        OutboxEvent.objects.filter(pk=event.pk).update(
+            attempts=event.attempts + 1,
+            status=OutboxEvent.STATUS_DONE,
+            processed_at=timezone.now(),
+        )
+        return True
+    finally:
+        connections.close_all()
+
+
+def process_batch(executor, batch_size=100, max_attempts=5, backoff=2, max_backoff=600, lease=300):
+    events = claim_events(batch_size, timedelta(seconds=lease))
+    results = list(executor.map(
+        lambda event: process_event(event, max_attempts, backoff, max_backoff),
+        events,
+    ))
+    return results.count(True), results.count(False)
+
+
+def make_executor(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
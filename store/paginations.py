@@ -1,5 +1,147 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Seek pagination on a composite key: the requested ordering plus `id` as a
+    tie breaker. The cursor carries the key of the boundary row, so every page
+    is a `WHERE key > boundary ORDER BY key LIMIT n` and no COUNT is issued.
+    """
+    page_size = 10
+    ordering = ('id',)
+    tie_breaker = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        # Search relevance is an annotation that cannot be part of the key, so
+        # a search is paged in the requested ordering, which must be explicit.
+        params = request.query_params
+        if params.get(api_settings.SEARCH_PARAM) and not params.get(api_settings.ORDERING_PARAM):
+            raise ValidationError({api_settings.ORDERING_PARAM: [
+                'Keyset pagination cannot order search results by relevance; choose an ordering.'
+            ]})
+        ordering = list(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in (self.tie_breaker, 'pk') for field in ordering):
+            descending = ordering[-1].startswith('-')
+            ordering.append(('-' if descending else '') + self.tie_breaker)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor['r'])
+        if self.cursor is not None:
+            queryset = queryset.filter(self.seek_filter(self.cursor['k'], reverse))
+        queryset = queryset.order_by(*self.get_directed_ordering(reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_directed_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith('-') else '-' + field
+            for field in self.ordering
+        )
+
+    def seek_filter(self, key, reverse):
+        # (a, b, c) > (x, y, z)  ==  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.get_directed_ordering(reverse), key):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_key(self, obj):
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(obj, dict):
+            return [obj[name] if name in obj else obj[f'{name}_id'] for name in names]
+        return [obj.serializable_value(name) for name in names]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            # A cursor is only valid for the ordering it was made for.
+            if cursor['o'] != list(self.ordering) or len(cursor['k']) != len(self.ordering):
+                raise ValueError
+            cursor['r'] = bool(cursor['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor):
+        encoded = b64encode(json.dumps(cursor, default=str).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor({'o': self.ordering, 'k': self.get_key(self.page[-1]), 'r': 0})
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor({'o': self.ordering, 'k': self.get_key(self.page[0]), 'r': 1})
+
+
+class CommentFeedPagination(KeysetPagination):
+    """Newest first, on the (product, status, datetime_created) comment index."""
+    page_size = 20
+    ordering = ('-datetime_created',)
+
+
+class KeysetPaginationMixin:
+    """
+    Lets clients opt in to keyset pagination with `?pagination=keyset`;
+    cursor links carry the `cursor` parameter and stay in keyset mode. With
+    `?search=`, an `?ordering=` is required: keyset pages cannot follow the
+    relevance order.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'keyset' or 'cursor' in params:
+                self._paginator = self.keyset_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
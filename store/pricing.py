@@ -0,0 +1,45 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Max
+from django.utils import timezone
+
+from store.models import Product
+
+TAX = Decimal('0.09')
+CENTS = Decimal('0.01')
+BATCH_SIZE = 1000
+
+
+def with_tax(price):
+    return (price * (1 + TAX)).quantize(CENTS, ROUND_HALF_UP)
+
+
+def effective_price(unit_price, discount=None):
+    """
+    The price a customer pays: `unit_price` less `discount`, the fraction
+    taken off by the product's largest discount (discounts do not stack),
+    plus tax.
+    """
+    return with_tax(unit_price * (1 - Decimal(str(discount or 0))))
+
+
+def best_discount(product_id):
+    return Product.discounts.through.objects.filter(product_id=product_id) \
+        .aggregate(best=Max('discount__discount'))['best']
+
+
+def refresh_effective_prices(products):
+    """
+    Recomputes the stored effective price of the `products` queryset and
+    returns the ids of the products whose price changed.
+    """
+    rows = products.order_by().annotate(best_discount=Max('discounts__discount')) \
+        .values_list('id', 'unit_price', 'effective_price', 'best_discount')
+    now = timezone.now()
+    changed = []
+    for product_id, unit_price, current, discount in rows.iterator():
+        price = effective_price(unit_price, discount)
+        if price != current:
+            changed.append(Product(id=product_id, effective_price=price, datetime_modified=now))
+    Product.objects.bulk_update(changed, ['effective_price', 'datetime_modified'], batch_size=BATCH_SIZE)
+    return [product.id for product in changed]
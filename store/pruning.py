@@ -0,0 +1,153 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class Unprunable(Exception):
+    pass
+
+
+def get_model_field(model, name):
+    if name == 'pk':
+        return model._meta.pk
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        raise Unprunable(f'{model.__name__}.{name} is not a model field')
+
+
+class Plan:
+    """The columns, joins and prefetches a serializer reads, relative to its model."""
+
+    def __init__(self, model, prefix=''):
+        self.model = model
+        self.prefix = prefix
+        self.only = set()
+        self.select = set()
+        self.prefetch = []
+
+    def add_source(self, attrs):
+        """Adds a dotted source; returns the model field it ends on."""
+        model, path = self.model, []
+        for attr in attrs[:-1]:
+            field = get_model_field(model, attr)
+            if not (field.many_to_one or field.one_to_one) or not field.concrete:
+                raise Unprunable(f'{model.__name__}.{attr} cannot be joined')
+            path.append(attr)
+            self.select.add(self.prefix + '__'.join(path))
+            model = field.related_model
+        field = get_model_field(model, attrs[-1])
+        path.append(field.name)
+        if field.concrete and not field.many_to_many:
+            self.only.add(self.prefix + '__'.join(path))
+        return field
+
+    def add_serializer(self, serializer):
+        meta = getattr(serializer, 'Meta', None)
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                if not hasattr(meta, 'extra_sources'):
+                    raise Unprunable(f'{field.field_name} has no extra_sources')
+            elif field.source == '*':
+                raise Unprunable(f'{field.field_name} reads the whole instance')
+            elif isinstance(field, serializers.ListSerializer):
+                self.add_many(field.source_attrs, field.child)
+            elif isinstance(field, serializers.ManyRelatedField):
+                self.add_many(field.source_attrs, None)
+            elif isinstance(field, serializers.BaseSerializer):
+                self.add_one(field.source_attrs, field)
+            elif isinstance(field, serializers.RelatedField) and not field.use_pk_only_optimization():
+                raise Unprunable(f'{field.field_name} reads the related instance')
+            else:
+                self.add_source(field.source_attrs)
+        for source in getattr(meta, 'extra_sources', []):
+            self.add_source(source.split('.'))
+
+    def add_one(self, attrs, serializer):
+        field = self.add_source(attrs)
+        if not (field.many_to_one or field.one_to_one) or not field.concrete:
+            raise Unprunable(f'{field.name} cannot be joined')
+        path = self.prefix + '__'.join(attrs)
+        self.select.add(path)
+        nested = Plan(field.related_model, path + '__')
+        nested.add_serializer(serializer)
+        self.only |= nested.only
+        self.select |= nested.select
+        self.prefetch += nested.prefetch
+
+    def add_many(self, attrs, child):
+        if len(attrs) != 1:
+            raise Unprunable(f'{".".join(attrs)} cannot be prefetched')
+        field = get_model_field(self.model, attrs[0])
+        if not (field.one_to_many or field.many_to_many):
+            raise Unprunable(f'{attrs[0]} is not a to-many relation')
+        nested = Plan(field.related_model)
+        if child is not None:
+            nested.add_serializer(child)
+        if field.one_to_many:
+            # The reverse foreign key is needed to attach the rows to their parent.
+            nested.only.add(field.field.name)
+        self.prefetch.append(Prefetch(self.prefix + field.name, queryset=nested.apply(field.related_model._default_manager.all())))
+
+    def apply(self, queryset):
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if self.select:
+            # select_related() without arguments would follow every foreign key.
+            queryset = queryset.select_related(*sorted(self.select))
+        return queryset.prefetch_related(*self.prefetch).only(*sorted(self.only | {'pk'}))
+
+
+@lru_cache(maxsize=256)
+def get_plan(serializer_class, model, fields=None, expand=None):
+    plan = Plan(model)
+    context = {'fields': fields and list(fields), 'expand': expand and list(expand)}
+    try:
+        plan.add_serializer(serializer_class(context=context))
+    except Unprunable:
+        return None
+    return plan
+
+
+def prune(queryset, serializer_class, context=None):
+    """
+    Restricts `queryset` to the columns `serializer_class` reads, joining
+    forward relations and prefetching to-many ones with their own pruned
+    querysets. Querysets the serializer cannot be mapped onto (sources that
+    are properties, SerializerMethodFields without Meta.extra_sources, ...)
+    are returned as they are. The `fields` and `expand` of the context
+    narrow the plan like they narrow the serializer.
+    """
+    context = context or {}
+    fields, expand = context.get('fields'), context.get('expand')
+    # The plan does not depend on their order or repetitions; normalized, the
+    # client cannot make every request a new cache entry.
+    plan = get_plan(
+        serializer_class, queryset.model,
+        None if fields is None else tuple(sorted(set(fields))),
+        None if expand is None else tuple(sorted(set(expand))),
+    )
+    if plan is None:
+        return queryset
+    return plan.apply(queryset)
+
+
+class PrunedQuerysetMixin:
+    """
+    Loads only the columns the view's serializer renders on read requests.
+    Writes keep full rows, as saving an instance with deferred fields skips
+    them, auto_now ones included.
+
+    Pruning happens in filter_queryset, which both list and get_object run,
+    so it also applies to views overriding get_queryset.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return prune(queryset, self.get_serializer_class(), self.get_serializer_context())
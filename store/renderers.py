@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def flatten(record, prefix=''):
+    """Flattens nested objects into dotted columns; lists are kept as JSON."""
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            row.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, list):
+            row[prefix + key] = json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+        else:
+            row[prefix + key] = value
+    return row
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    A renderer that can also write its output incrementally: `stream` takes
+    an iterable of lists of records and yields the bytes of each list.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b''.join(self.stream([data if isinstance(data, list) else [data]]))
+
+    def stream(self, chunks):
+        raise NotImplementedError
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def stream(self, chunks):
+        for records in chunks:
+            yield ''.join(
+                json.dumps(record, cls=JSONEncoder, ensure_ascii=False) + '\n' for record in records
+            ).encode(self.charset)
+
+
+class CSVRenderer(StreamingRenderer):
+    """Writes one line per record, with the columns of the first one as header."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, chunks):
+        buffer = io.StringIO()
+        writer = None
+        for records in chunks:
+            for record in records:
+                row = flatten(record)
+                if writer is None:
+                    writer = csv.DictWriter(buffer, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
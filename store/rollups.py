@@ -0,0 +1,145 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from store.models import CategoryDailySales, Order, OrderItem, ProductDailySales
+
+BATCH_SIZE = 1000
+
+# (rollup model, its key field, the path to that key from OrderItem)
+ROLLUPS = [
+    (ProductDailySales, 'product', 'product'),
+    (CategoryDailySales, 'category', 'product__category'),
+]
+
+
+def order_day(order):
+    created = order.datetime_created
+    return timezone.localdate(created) if timezone.is_aware(created) else created.date()
+
+
+def order_deltas(order, status, sign):
+    """What the items of `order` add to (sign=1) or take from (sign=-1) the rows of `status`."""
+    day = order_day(order)
+    deltas = {model: {} for model, _, _ in ROLLUPS}
+    items = OrderItem.objects.filter(order_id=order.pk) \
+        .values_list('product', 'product__category', 'quantity', 'unit_price')
+    for product_id, category_id, quantity, unit_price in items:
+        for model, key in ((ProductDailySales, product_id), (CategoryDailySales, category_id)):
+            # An order counts once per product and once per category.
+            delta = deltas[model].setdefault((key, day, status), [0, Decimal(0), sign])
+            delta[0] += sign * quantity
+            delta[1] += sign * quantity * unit_price
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Adds the deltas to their rows with one INSERT of the missing rows and one
+    UPDATE per rollup model, however many products and categories they touch.
+    A total never goes below zero, even when a row is behind its orders.
+    """
+    for model, key, _ in ROLLUPS:
+        rows = deltas[model]
+        if not rows:
+            continue
+        model.objects.bulk_create(
+            [model(**{f'{key}_id': key_id}, day=day, status=status) for key_id, day, status in rows],
+            ignore_conflicts=True,
+        )
+        matches = [
+            (Q(**{f'{key}_id': key_id}, day=day, status=status), delta)
+            for (key_id, day, status), delta in sorted(rows.items())
+        ]
+
+        def added(field, index):
+            output_field = model._meta.get_field(field)
+            return Greatest(F(field) + Case(
+                *[When(match, then=Value(delta[index], output_field=output_field)) for match, delta in matches],
+                default=Value(0, output_field=output_field),
+            ), Value(0, output_field=output_field))
+
+        model.objects.filter(reduce(or_, [match for match, _ in matches])).update(
+            units=added('units', 0),
+            revenue=added('revenue', 1),
+            orders=added('orders', 2),
+        )
+
+
+def merge_deltas(deltas, other):
+    """Adds the deltas of `other` to `deltas`."""
+    for model, rows in other.items():
+        for row, delta in rows.items():
+            total = deltas[model].setdefault(row, [0, Decimal(0), 0])
+            for index, value in enumerate(delta):
+                total[index] += value
+    return deltas
+
+
+def record_order(order):
+    """Adds a newly placed order, items included, to the rollups. Call it in the checkout transaction."""
+    with transaction.atomic():
+        apply_deltas(order_deltas(order, order.status, 1))
+
+
+def move_order(order, old_status):
+    """Moves an order from the rows of `old_status` to the rows of its current status."""
+    with transaction.atomic():
+        apply_deltas(merge_deltas(order_deltas(order, old_status, -1), order_deltas(order, order.status, 1)))
+
+
+def rebuild(start=None, end=None):
+    """
+    Recomputes the rollups of the days from `start` to `end` (both optional
+    and inclusive) from the order items. Returns the number of rows written
+    per rollup model.
+    """
+    items = OrderItem.objects.annotate(day=TruncDate('order__datetime_created'))
+    days = Q()
+    if start is not None:
+        items, days = items.filter(day__gte=start), days & Q(day__gte=start)
+    if end is not None:
+        items, days = items.filter(day__lte=end), days & Q(day__lte=end)
+
+    written = {}
+    with transaction.atomic():
+        for model, key, path in ROLLUPS:
+            model.objects.filter(days).delete()
+            rows = items.values(path, 'day', 'order__status').order_by().annotate(
+                units=Sum('quantity'),
+                revenue=Sum(F('quantity') * F('unit_price')),
+                orders=Count('order', distinct=True),
+            )
+            objs = model.objects.bulk_create([
+                model(
+                    **{f'{key}_id': row[path]}, day=row['day'], status=row['order__status'],
+                    units=row['units'], revenue=row['revenue'], orders=row['orders'],
+                ) for row in rows.iterator()
+            ], batch_size=BATCH_SIZE)
+            written[model] = len(objs)
+    return written
+
+
+def daily_report(start, end, product=None, category=None):
+    """
+    One row per day, and per category unless a product or a category is
+    given, with the units and revenue of the orders that were not canceled
+    and the number of orders by status. Reads only the rollups.
+    """
+    if product is not None:
+        key, rows = 'product', ProductDailySales.objects.filter(product_id=product)
+    elif category is not None:
+        key, rows = 'category', CategoryDailySales.objects.filter(category_id=category)
+    else:
+        key, rows = 'category', CategoryDailySales.objects.all()
+    sold = ~Q(status=Order.ORDER_STATUS_CANCELED)
+    return rows.filter(day__range=(start, end)).values(key, 'day').annotate(
+        units=Sum('units', filter=sold, default=0),
+        revenue=Sum('revenue', filter=sold, default=0),
+        **{f'orders_{status}': Sum('orders', filter=Q(status=status), default=0) for status, _ in Order.ORDER_STATUS},
+    ).order_by('day', key)
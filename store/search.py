@@ -0,0 +1,77 @@
+import re
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+
+from store.models import Product, ProductSearchToken
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = ProductSearchToken._meta.get_field('token').max_length
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 1
+BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def product_tokens(product_id, name, category_title):
+    weights = {}
+    for token in tokenize(name):
+        weights[token] = weights.get(token, 0) + NAME_WEIGHT
+    for token in tokenize(category_title or ''):
+        weights[token] = weights.get(token, 0) + CATEGORY_WEIGHT
+    return [
+        ProductSearchToken(product_id=product_id, token=token, weight=weight)
+        for token, weight in weights.items()
+    ]
+
+
+def index_products(product_ids):
+    """(Re)builds the search tokens of the given products."""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            rows = Product.objects.filter(pk__in=batch).values_list('id', 'name', 'category__title')
+            tokens = [token for row in rows for token in product_tokens(*row)]
+            ProductSearchToken.objects.filter(product_id__in=batch).delete()
+            ProductSearchToken.objects.bulk_create(tokens, batch_size=BATCH_SIZE)
+
+
+def rebuild_index():
+    """
+    Reindexes every product. Each batch replaces its products' tokens in one
+    transaction, so search keeps answering from the old tokens of the
+    products not reached yet; tokens of deleted products go with them.
+    """
+    product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    index_products(product_ids.iterator(chunk_size=BATCH_SIZE))
+
+
+def prefix_match(term):
+    # LIKE 'term%' seeks the (token, product) index and, unlike a range up to
+    # the next character, does not depend on the column's collation order.
+    return Q(token__startswith=term)
+
+
+def search_products(queryset, text):
+    """
+    Products matching every term of `text` by token prefix, ranked by the
+    summed weight of their matching tokens.
+    """
+    terms = tokenize(text)
+    if not terms:
+        return queryset
+    any_term = Q()
+    for term in terms:
+        any_term |= prefix_match(term)
+        queryset = queryset.filter(
+            pk__in=ProductSearchToken.objects.filter(prefix_match(term)).values('product_id')
+        )
+    rank = ProductSearchToken.objects.filter(any_term, product_id=OuterRef('pk')) \
+        .values('product_id') \
+        .annotate(rank=Sum('weight')) \
+        .values('rank')
+    return queryset.annotate(search_rank=Subquery(rank)).order_by('-search_rank', 'pk')
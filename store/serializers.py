@@ -1,32 +1,41 @@
 from rest_framework import serializers
-from decimal import Decimal
+from rest_framework.exceptions import NotFound
+from datetime import timedelta
+from django.utils import timezone
 from django.utils.text import slugify
 from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Value, When
+from rest_framework.settings import api_settings
 
+from core.profiling import ProfiledSerializerMixin
+from store.fieldsets import SparseFieldsetMixin, select_fields
+from store import outbox, pricing, rollups, search
+from store.caching import product_cache
 from store.models import Cart, CartItem, Category, Comment, Customer, Order, OrderItem, Product
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'title', 'description', 'product_number']
-    # product_number = serializers.SerializerMethodField(read_only=True)
-    product_number = serializers.IntegerField(read_only=True, source='products.count')
-
-    # def get_product_number(self, category):
-    #     try:
-    #         num = category.product_count
-    #     except AttributeError:
-    #         num = 0
-    #     return num
+    product_number = serializers.SerializerMethodField(read_only=True)
+
+    def get_product_number(self, category):
+        return getattr(category, 'products_count', 0)
     
     def validate(self, data):
         if len(data['title']) < 3:
             raise serializers.ValidationError("Category title should be at least 6.")
         return super().validate(data)
 
-class ProductSerializer(serializers.ModelSerializer):
-    TAX = 0.09
+class ProductCategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'title']
+
+
+class ProductSerializer(SparseFieldsetMixin, ProfiledSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = {'category': lambda: ProductCategorySerializer(read_only=True)}
 
     title = serializers.CharField(max_length=255, source='name')
     price = serializers.DecimalField(max_digits=6, decimal_places=2, source="unit_price")
@@ -34,11 +43,13 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'title', 'price', 'category', 'price_after_tax', 'inventory', 'description']
+        fields = ['id', 'title', 'price', 'category', 'price_after_tax', 'effective_price', 'inventory', 'description']
+        # Columns read by the get_* methods, see store.pruning.
+        extra_sources = ['unit_price']
     
 
     def get_price_after_tax(self, product):
-        return round(product.unit_price * Decimal(1 + self.TAX), 2)
+        return pricing.with_tax(product.unit_price)
     
     def validate(self, data):
         if len(data['name']) < 6:
@@ -58,10 +69,114 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class ProductBulkListSerializer(serializers.ListSerializer):
+    BATCH_SIZE = 1000
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='not_a_list')
+
+        rows, errors = [], []
+        for item in data:
+            try:
+                rows.append(self.run_child_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                rows.append(None)
+                errors.append(exc.detail)
+
+        # Relations are checked once for the whole batch instead of per row.
+        valid = [row for row in rows if row is not None]
+        categories = set(Category.objects.filter(pk__in={row['category'] for row in valid}).values_list('pk', flat=True))
+        products = set(Product.objects.filter(pk__in={row['id'] for row in valid if 'id' in row}).values_list('pk', flat=True))
+        seen = set()
+        for row, row_errors in zip(rows, errors):
+            if row is None:
+                continue
+            if row['category'] not in categories:
+                row_errors['category'] = [f'Invalid pk "{row["category"]}" - object does not exist.']
+            if 'id' in row:
+                if row['id'] not in products:
+                    row_errors['id'] = [f'Invalid pk "{row["id"]}" - object does not exist.']
+                elif row['id'] in seen:
+                    row_errors['id'] = [f'Product {row["id"]} appears more than once.']
+                seen.add(row['id'])
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def create(self, validated_data):
+        created, updated = [], []
+        for row in validated_data:
+            product = Product(
+                id=row.get('id'),
+                name=row['title'],
+                slug=slugify(row['title']),
+                unit_price=row['price'],
+                effective_price=pricing.effective_price(row['price']),
+                category_id=row['category'],
+                inventory=row['inventory'],
+                description=row['description'],
+            )
+            (updated if product.id else created).append(product)
+
+        now = timezone.now()
+        for product in updated:
+            product.datetime_modified = now
+
+        with transaction.atomic():
+            last_id = Product.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            Product.objects.bulk_create(created, batch_size=self.BATCH_SIZE)
+            Product.objects.bulk_update(
+                updated,
+                ['name', 'slug', 'unit_price', 'category', 'inventory', 'description', 'datetime_modified'],
+                batch_size=self.BATCH_SIZE,
+            )
+            # bulk_create only sets primary keys on backends that return them.
+            if all(product.pk for product in created):
+                created_ids = [product.pk for product in created]
+            else:
+                created_ids = list(Product.objects.filter(pk__gt=last_id).values_list('pk', flat=True))
+            updated_ids = [product.pk for product in updated]
+            # Replaced products keep their discounts.
+            pricing.refresh_effective_prices(Product.objects.filter(pk__in=updated_ids))
+
+            # bulk_create/bulk_update send no signals; do what the Product handlers would.
+            search.index_products(created_ids + updated_ids)
+            if updated_ids:
+                Cart.objects.filter(pk__in=CartItem.objects.filter(product_id__in=updated_ids).values('cart')) \
+                    .refresh_totals()
+            transaction.on_commit(product_cache.invalidate)
+        return created + updated
+
+
+class ProductBulkSerializer(serializers.Serializer):
+    """
+    A row of a bulk product import: created without an `id`, replaced with
+    one. Use with many=True.
+    """
+    id = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2)
+    category = serializers.IntegerField()
+    inventory = serializers.IntegerField(min_value=0)
+    description = serializers.CharField(allow_blank=True)
+
+    class Meta:
+        list_serializer_class = ProductBulkListSerializer
+
+    def validate_title(self, title):
+        if len(title) < 6:
+            raise serializers.ValidationError("Product title should be at least 6.")
+        return title
+
+
+class CommentSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = ['id', 'name', 'body']
+        fields = ['id', 'name', 'body', 'datetime_created']
 
     def create(self, validated_data):
         product_pk = self.context['product_pk']
@@ -71,56 +186,70 @@ class CommentSerializer(serializers.ModelSerializer):
 class CartProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'name', 'unit_price', ]
+        fields = ['id', 'name', 'unit_price', 'effective_price']
 
 
-class UpdateCartItemSerializer(serializers.ModelSerializer):
+class UpdateCartItemSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['quantity']
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
-class AddCartItemSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            # The delta is taken from the locked row, not from the instance,
+            # which a concurrent update may have changed since it was read.
+            Cart.objects.filter(pk=instance.cart_id).lock()
+            instance.quantity = CartItem.objects.select_for_update() \
+                .filter(pk=instance.pk) \
+                .values_list('quantity', flat=True) \
+                .first()
+            if instance.quantity is None:
+                raise NotFound()
+            quantity_delta = validated_data.get('quantity', instance.quantity) - instance.quantity
+            instance = super().update(instance, validated_data)
+            Cart.objects.filter(pk=instance.cart_id) \
+                .add_to_totals(quantity_delta, quantity_delta * instance.product.effective_price)
+        return instance
+
+class AddCartItemSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity']
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
     def create(self, validated_data):
         cart_id = self.context['cart_pk']
         product = validated_data.get('product')
-        quantity = validated_data['quantity']
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product)
-            cart_item.quantity += quantity
-            cart_item.save()
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(cart_id=cart_id, **validated_data)
+        quantity = validated_data.get('quantity', 1)
+        with transaction.atomic():
+            # The cart row is locked before the item, in the order checkout locks them.
+            Cart.objects.filter(pk=cart_id).add_to_totals(quantity, quantity * product.effective_price)
+            cart_item = CartItem.objects.add_quantity(cart_id, product.id, quantity)
         self.instance = cart_item
         return cart_item
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     product = CartProductSerializer(read_only=True)
     item_total = serializers.SerializerMethodField()
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'item_total']
+        extra_sources = ['quantity', 'product.effective_price']
     
     def get_item_total(self, item:CartItem):
-        return item.quantity * item.product.unit_price
+        return item.quantity * item.product.effective_price
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total_price']
-        read_only_fields = ['id']
+        fields = ['id', 'items', 'items_count', 'total_price']
+        read_only_fields = ['id', 'items_count', 'total_price']
 
     items = CartItemSerializer(many=True, read_only=True)
-    total_price = serializers.SerializerMethodField()
 
-    def get_total_price(self, cart):
-        return sum([(item.quantity*item.product.unit_price) for item in cart.items.all()])
 
-
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = ['id', 'user', 'birth_date']
@@ -148,7 +277,9 @@ class OrderCustomerSerializer(serializers.ModelSerializer):
 
 
 
-class OrderForAdminSerializer(serializers.ModelSerializer):
+class OrderForAdminSerializer(SparseFieldsetMixin, ProfiledSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = {'items': None}
+    default_expand = ('items',)
     items = OrderItemSerializer(many=True, read_only=True)
     customer = OrderCustomerSerializer()
     class Meta:
@@ -157,7 +288,9 @@ class OrderForAdminSerializer(serializers.ModelSerializer):
         read_only_fields = ['customer', 'status']
 
 
-class OrderForUserSerializer(serializers.ModelSerializer):
+class OrderForUserSerializer(SparseFieldsetMixin, ProfiledSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = {'items': None}
+    default_expand = ('items',)
     items = OrderItemSerializer(many=True, read_only=True)
     class Meta:
         model = Order
@@ -169,9 +302,10 @@ class OrderCreateSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(id=cart_id).exists():
+        items_count = Cart.objects.filter(id=cart_id).values_list('items_count', flat=True).first()
+        if items_count is None:
             raise serializers.ValidationError('There is no cart with this cart id!')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if items_count == 0:
             raise serializers.ValidationError('Your cart is empty! Please add some product to it first.')
         return cart_id
     
@@ -179,26 +313,257 @@ class OrderCreateSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
             user_id = self.context['user_id']
-            customer = Customer.objects.get(user_id=user_id)
-
-            order = Order()
-            order.customer = customer
-            order.save()
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id)
-            order_items = [
-                            OrderItem(
-                                    order = order,
-                                    product_id = item.product_id,
-                                    unit_price = item.product.unit_price,
-                                    quantity = item.quantity
-                                ) for item in cart_items
-                        ]
-            OrderItem.objects.bulk_create(order_items)
-            Cart.objects.get(id=cart_id).delete()
+            customer = Customer.objects.only('id').get(user_id=user_id)
+
+            # Lock the cart before reading its items: a concurrent checkout of
+            # the same cart waits here, then finds it gone instead of ordering
+            # it a second time. Cart item changes lock the cart first as well.
+            if not Cart.objects.filter(id=cart_id).lock():
+                raise serializers.ValidationError({'cart_id': ['There is no cart with this cart id!']})
+            quantities = dict(
+                CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity')
+            )
+            if not quantities:
+                raise serializers.ValidationError({'cart_id': ['Your cart is empty! Please add some product to it first.']})
+            # Lock the product rows in primary key order so concurrent checkouts
+            # sharing products always acquire the locks in the same order.
+            products = Product.objects.select_for_update() \
+                .filter(pk__in=quantities) \
+                .order_by('pk') \
+                .values('id', 'effective_price', 'inventory')
+            products = {product['id']: product for product in products}
+
+            out_of_stock = {
+                product_id: f"Only {products[product_id]['inventory']} left in stock, {quantity} requested."
+                for product_id, quantity in quantities.items()
+                if products[product_id]['inventory'] < quantity
+            }
+            if out_of_stock:
+                raise serializers.ValidationError({'out_of_stock': out_of_stock})
+
+            quantity = Case(
+                *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+                output_field=IntegerField(),
+            )
+            reserved = Product.objects \
+                .filter(pk__in=quantities, inventory__gte=quantity) \
+                .update(inventory=F('inventory') - quantity, datetime_modified=timezone.now())
+            if reserved != len(quantities):
+                raise serializers.ValidationError('Some products in your cart just went out of stock. Please try again.')
+            transaction.on_commit(product_cache.invalidate)
+
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=product_id,
+                    unit_price=products[product_id]['effective_price'],
+                    quantity=quantity,
+                ) for product_id, quantity in quantities.items()
+            ])
+            rollups.record_order(order)
+            # The cart is locked and has no other dependents: delete it and
+            # its items with one statement each, without collecting them.
+            CartItem.objects.filter(cart_id=cart_id)._raw_delete(CartItem.objects.db)
+            Cart.objects.filter(id=cart_id)._raw_delete(Cart.objects.db)
+            outbox.publish('order_created', order_id=order.id)
             return order
         
 
-class OrderUpdateSerializer(serializers.ModelSerializer):
+class OrderUpdateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['status',]
\ No newline at end of file
+        fields = ['status',]
+
+
+class SalesReportParamsSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    product = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start should not be after end.')
+        if 'product' in data and 'category' in data:
+            raise serializers.ValidationError('Filter on a product or a category, not both.')
+        return data
+
+
+class SalesReportSerializer(ProfiledSerializerMixin, serializers.Serializer):
+    day = serializers.DateField()
+    product = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    orders = serializers.SerializerMethodField()
+
+    def get_orders(self, row):
+        return {label.lower(): row[f'orders_{status}'] for status, label in Order.ORDER_STATUS}
+
+
+# Read-only serializers for the list endpoints. They take `.values()` rows
+# instead of model instances and build each dict directly, formatting values
+# with the same DRF fields as the serializers above, so the rendered output
+# is identical to theirs.
+
+class ValuesSerializer(ProfiledSerializerMixin, serializers.BaseSerializer):
+    """
+    `field_columns` maps every output field, in output order, to the columns
+    it is built from, and `expanded_columns` does the same for the expanded
+    form of the expandable fields. A field is built by `get_<field>(row)`, or
+    `expand_<field>(row)` when expanded; one without a `get_` method is left
+    out unless expanded. `key_columns` are always selected for ordering and
+    keyset pagination.
+    """
+    field_columns = {}
+    expanded_columns = {}
+    default_expand = ()
+    key_columns = ['id']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field_names, self.expanded = select_fields(
+            self.context, list(self.field_columns), self.expanded_columns, self.default_expand,
+        )
+        self.builders = []
+        for name in self.field_names:
+            builder = getattr(self, f'expand_{name}' if name in self.expanded else f'get_{name}', None)
+            if builder is not None:
+                self.builders.append((name, builder))
+
+    def get_columns(self):
+        columns = dict.fromkeys(self.key_columns)
+        for name, _ in self.builders:
+            columns.update(dict.fromkeys(
+                self.expanded_columns[name] if name in self.expanded else self.field_columns[name]
+            ))
+        return list(columns)
+
+    def get_values(self, queryset):
+        return queryset.prefetch_related(None).values(*self.get_columns())
+
+    def prefetch(self, rows):
+        return rows
+
+    def to_representation(self, row):
+        return {name: builder(row) for name, builder in self.builders}
+
+
+class ProductValuesSerializer(ValuesSerializer):
+    field_columns = {
+        'id': ['id'],
+        'title': ['name'],
+        'price': ['unit_price'],
+        'category': ['category'],
+        'price_after_tax': ['unit_price'],
+        'effective_price': ['effective_price'],
+        'inventory': ['inventory'],
+        'description': ['description'],
+    }
+    expanded_columns = {'category': ['category', 'category__title']}
+    key_columns = ['id', 'name', 'unit_price', 'effective_price', 'inventory']
+    price = serializers.DecimalField(max_digits=6, decimal_places=2)
+    effective_price = serializers.DecimalField(max_digits=8, decimal_places=2)
+
+    def get_id(self, row):
+        return row['id']
+
+    def get_title(self, row):
+        return row['name']
+
+    def get_price(self, row):
+        return self.price.to_representation(row['unit_price'])
+
+    def get_category(self, row):
+        return row['category']
+
+    def expand_category(self, row):
+        return {'id': row['category'], 'title': row['category__title']}
+
+    def get_price_after_tax(self, row):
+        return pricing.with_tax(row['unit_price'])
+
+    def get_effective_price(self, row):
+        return self.effective_price.to_representation(row['effective_price'])
+
+    def get_inventory(self, row):
+        return row['inventory']
+
+    def get_description(self, row):
+        return row['description']
+
+
+class OrderItemValuesSerializer(ProfiledSerializerMixin, serializers.BaseSerializer):
+    columns = ['id', 'order', 'quantity', 'unit_price', 'product', 'product__name', 'product__unit_price']
+    price = serializers.DecimalField(max_digits=6, decimal_places=2)
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'product': {
+                'id': row['product'],
+                'name': row['product__name'],
+                'unit_price': self.price.to_representation(row['product__unit_price']),
+            },
+            'quantity': row['quantity'],
+            'unit_price': self.price.to_representation(row['unit_price']),
+        }
+
+
+class OrderForUserValuesSerializer(ValuesSerializer):
+    field_columns = {
+        'id': ['id'],
+        'items': [],
+        'status': ['status'],
+        'datetime_created': ['datetime_created'],
+    }
+    expanded_columns = {'items': []}
+    default_expand = ('items',)
+    key_columns = ['id', 'customer', 'datetime_created']
+    datetime_created = serializers.DateTimeField()
+    items = OrderItemValuesSerializer()
+
+    def prefetch(self, rows):
+        """Attaches the items of every order in one query, when they are expanded."""
+        if 'items' not in self.expanded:
+            return rows
+        items = {row['id']: [] for row in rows}
+        item_rows = OrderItem.objects.filter(order_id__in=items).values(*OrderItemValuesSerializer.columns)
+        for item in item_rows:
+            items[item['order']].append(item)
+        for row in rows:
+            row['items'] = items[row['id']]
+        return rows
+
+    def get_id(self, row):
+        return row['id']
+
+    def expand_items(self, row):
+        return [self.items.to_representation(item) for item in row['items']]
+
+    def get_status(self, row):
+        return row['status']
+
+    def get_datetime_created(self, row):
+        return self.datetime_created.to_representation(row['datetime_created'])
+
+
+class OrderForAdminValuesSerializer(OrderForUserValuesSerializer):
+    field_columns = {
+        'id': ['id'],
+        'items': [],
+        'customer': ['customer', 'customer__user__first_name', 'customer__birth_date'],
+        'status': ['status'],
+        'datetime_created': ['datetime_created'],
+    }
+    birth_date = serializers.DateField()
+
+    def get_customer(self, row):
+        return {
+            'id': row['customer'],
+            'first_name': row['customer__user__first_name'],
+            'birth_date': self.birth_date.to_representation(row['customer__birth_date']),
+        }
@@ -1,11 +1,132 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.conf import settings
 
-from store.models import Customer
+from store import pricing, rollups, search
+from store.caching import comment_cache, product_cache
+from store.models import Cart, Category, Comment, Customer, Discount, Order, Product
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_profile_for_newly_created_user(sender, instance, created, **kwargs):
     if created:
         Customer.objects.create(user=instance)
+
+
+@receiver(pre_save, sender=Product)
+def set_effective_price(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'unit_price' in update_fields:
+        discount = pricing.best_discount(instance.pk) if instance.pk else None
+        instance.effective_price = pricing.effective_price(instance.unit_price, discount)
+
+
+def reprice_products(products):
+    changed = pricing.refresh_effective_prices(products)
+    if changed:
+        Cart.objects.filter(items__product__in=changed).refresh_totals()
+
+
+@receiver(m2m_changed, sender=Product.discounts.through)
+def reprice_products_on_discounts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        reprice_products(Product.objects.filter(pk=instance.pk))
+    elif action == 'post_clear':
+        reprice_products(Product.objects.filter(pk__in=instance._cleared_product_ids))
+    else:
+        reprice_products(Product.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Discount)
+def reprice_discounted_products(sender, instance, created, **kwargs):
+    if not created:
+        reprice_products(instance.products.all())
+
+
+@receiver(pre_delete, sender=Discount)
+def remember_discounted_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Discount)
+def reprice_products_of_deleted_discount(sender, instance, **kwargs):
+    reprice_products(Product.objects.filter(pk__in=instance._product_ids))
+
+
+@receiver(post_save, sender=Product)
+def refresh_totals_of_carts_containing_product(sender, instance, created, **kwargs):
+    if not created:
+        Cart.objects.filter(items__product=instance).refresh_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+@receiver(m2m_changed, sender=Product.discounts.through)
+def invalidate_product_cache(sender, **kwargs):
+    product_cache.invalidate()
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category_products_for_search(sender, instance, created, **kwargs):
+    if not created:
+        search.index_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    instance._saved_status = instance.pk and Order.objects.filter(pk=instance.pk) \
+        .values_list('status', flat=True) \
+        .first()
+
+
+@receiver(post_save, sender=Order)
+def move_order_in_sales_rollups(sender, instance, created, **kwargs):
+    # New orders are added by the checkout, once their items exist.
+    saved_status = getattr(instance, '_saved_status', None)
+    if not created and saved_status and saved_status != instance.status:
+        rollups.move_order(instance, saved_status)
+
+
+@receiver(post_init, sender=Comment)
+def remember_comment_state(sender, instance, **kwargs):
+    # Read from __dict__: touching a deferred field would query it.
+    instance._saved_state = (instance.__dict__.get('product_id'), instance.__dict__.get('status'))
+
+
+@receiver(post_save, sender=Comment)
+def refresh_product_comment_stats(sender, instance, created, **kwargs):
+    saved_product, saved_status = instance._saved_state
+    approved = Comment.COMMENT_STATUS_APPROVED
+    if created:
+        stale = [instance.product_id] if instance.status == approved else []
+    elif saved_status is None:
+        # The status was not loaded, so it may have changed.
+        stale = [saved_product or instance.product_id, instance.product_id]
+    elif (saved_product, saved_status) != (instance.product_id, instance.status) \
+            and approved in (saved_status, instance.status):
+        stale = [saved_product, instance.product_id]
+    else:
+        stale = []
+    if stale:
+        Product.objects.filter(pk__in=stale).refresh_comment_stats()
+    instance._saved_state = (instance.product_id, instance.status)
+    comment_cache.invalidate()
+
+
+@receiver(post_delete, sender=Comment)
+def refresh_product_comment_stats_on_delete(sender, instance, **kwargs):
+    if instance.__dict__.get('status', Comment.COMMENT_STATUS_APPROVED) == Comment.COMMENT_STATUS_APPROVED:
+        Product.objects.filter(pk=instance.product_id).refresh_comment_stats()
+    comment_cache.invalidate()
@@ -1,3 +1,1473 @@
-from django.test import TestCase
+import json
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Prefetch, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.models import SlowRequest
+from core.profiling import RequestProfile
+from core.routers import PrimaryReplicaRouter, replica_reads
+
+from store import benchmarks, outbox, rollups, search
+from store.caching import comment_cache, product_cache
+from store.pruning import get_plan
+
+from store.models import (
+    Cart, CartItem, Category, CategoryDailySales, Comment, Customer, Discount, Order, OrderItem, OutboxEvent, Product,
+    ProductDailySales, ProductSearchToken,
+)
+from store.signals import order_created
+from store.serializers import (
+    OrderCreateSerializer, OrderForAdminSerializer, OrderForAdminValuesSerializer, OrderForUserSerializer, OrderForUserValuesSerializer,
+    ProductSerializer, ProductValuesSerializer, UpdateCartItemSerializer,
+)
+from store.views import ProductViewSet
+
+
+def setUpModule():
+    # Keep the JSON line RequestProfilingMiddleware logs for every request out
+    # of the test output; RequestProfilingTests read them with assertLogs.
+    logging.getLogger('core.requests').setLevel(logging.WARNING)
+
+
+def tearDownModule():
+    logging.getLogger('core.requests').setLevel(logging.NOTSET)
+
+
+class AddCartItemConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('In-memory SQLite cannot be shared between threads.')
+        category = Category.objects.create(title='Laptop')
+        self.product = Product.objects.create(
+            name='Gaming Laptop', slug='gaming-laptop', category=category,
+            description='', unit_price=Decimal('12.50'), inventory=100,
+        )
+        self.cart = Cart.objects.create()
+
+    def add_to_cart(self, _):
+        client = APIClient()
+        try:
+            for _ in range(self.ADDS_PER_THREAD):
+                response = client.post(
+                    f'/store/carts/{self.cart.id}/items/',
+                    {'product': self.product.id, 'quantity': 1},
+                )
+                self.assertEqual(response.status_code, 201)
+        finally:
+            connection.close()
+
+    def test_concurrent_adds_do_not_lose_increments(self):
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(executor.map(self.add_to_cart, range(self.THREADS)))
+
+        expected = self.THREADS * self.ADDS_PER_THREAD
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, expected)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items_count, expected)
+        self.assertEqual(self.cart.total_price, expected * self.product.effective_price)
+
+
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Keyset')
+        # Three prices shared by many products, so pages split ties.
+        Product.objects.bulk_create([
+            Product(
+                name=f'Keyset Product {i:02}', slug=f'keyset-product-{i}', category=category,
+                unit_price=Decimal(10 + i % 3), effective_price=Decimal(10 + i % 3), inventory=1,
+            ) for i in range(25)
+        ])
+        search.index_products(Product.objects.values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def pages(self, path):
+        pages, response = [], self.client.get(path).json()
+        pages.append(response)
+        while response['next']:
+            response = self.client.get(response['next']).json()
+            pages.append(response)
+        return pages
+
+    def ids(self, page):
+        return [product['id'] for product in page['results']]
+
+    def test_next_and_previous_cover_every_row_once(self):
+        pages = self.pages('/store/products/?pagination=keyset&ordering=unit_price')
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        expected = list(Product.objects.order_by('unit_price', 'id').values_list('id', flat=True))
+        self.assertEqual([id for page in pages for id in self.ids(page)], expected)
+
+        self.assertIsNone(pages[0]['previous'])
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(self.ids(previous), self.ids(pages[1]))
+        self.assertEqual(self.ids(self.client.get(previous['previous']).json()), self.ids(pages[0]))
+
+    def test_ties_are_broken_by_id(self):
+        for ordering, id_order in [('unit_price', 'id'), ('-unit_price', '-id')]:
+            with self.subTest(ordering=ordering):
+                pages = self.pages(f'/store/products/?pagination=keyset&ordering={ordering}')
+                rows = [(product['price'], product['id']) for page in pages for product in page['results']]
+                expected = Product.objects.order_by(ordering, id_order).values_list('unit_price', 'id')
+                self.assertEqual(rows, [(float(price), id) for price, id in expected])
+
+    def test_tampered_or_mismatched_cursors_are_rejected(self):
+        next_link = self.client.get('/store/products/?pagination=keyset&ordering=unit_price').json()['next']
+        cursor = parse_qs(urlparse(next_link).query)['cursor'][0]
+        for path in [
+            '/store/products/?pagination=keyset&ordering=unit_price&cursor=not-a-cursor',
+            f'/store/products/?pagination=keyset&ordering=name&cursor={cursor}',
+            f'/store/products/?pagination=keyset&ordering=-unit_price&cursor={cursor}',
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_search_needs_an_explicit_ordering(self):
+        response = self.client.get('/store/products/?pagination=keyset&search=keyset')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.json())
+        response = self.client.get('/store/products/?pagination=keyset&search=keyset&ordering=name')
+        self.assertEqual(len(response.json()['results']), 10)
+
+
+
+class CartTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Totals')
+        cls.products = [
+            Product.objects.create(
+                name=f'Totals Product {i}', slug=f'totals-product-{i}', category=category,
+                unit_price=Decimal('10.00') * (i + 1), inventory=10,
+            ) for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+
+    def items_path(self, item=None):
+        return f'/store/carts/{self.cart.id}/items/' + (f'{item}/' if item else '')
+
+    def assertTotals(self, items_count, total_price):
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.items_count, self.cart.total_price), (items_count, Decimal(total_price)))
+        Cart.objects.filter(pk=self.cart.pk).refresh_totals()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.items_count, self.cart.total_price), (items_count, Decimal(total_price)))
+
+    def test_totals_follow_adds_updates_and_deletes(self):
+        first, second = self.products
+        item = self.client.post(self.items_path(), {'product': first.id, 'quantity': 2}).json()['id']
+        self.client.post(self.items_path(), {'product': second.id, 'quantity': 1})
+        self.client.post(self.items_path(), {'product': first.id, 'quantity': 1})
+        self.assertTotals(4, '54.50')
+        self.client.patch(self.items_path(item), {'quantity': 1})
+        self.assertTotals(2, '32.70')
+        self.assertEqual(self.client.delete(self.items_path(item)).status_code, 204)
+        self.assertTotals(1, '21.80')
+
+    def test_quantities_below_one_are_rejected(self):
+        item = self.client.post(self.items_path(), {'product': self.products[0].id, 'quantity': 2}).json()['id']
+        for quantity in [0, -5]:
+            with self.subTest(quantity=quantity):
+                response = self.client.post(self.items_path(), {'product': self.products[0].id, 'quantity': quantity})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('quantity', response.json())
+                response = self.client.patch(self.items_path(item), {'quantity': quantity})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('quantity', response.json())
+        self.assertTotals(2, '21.80')
+
+    def test_update_of_a_stale_item_uses_the_current_quantity(self):
+        item = CartItem.objects.add_quantity(self.cart.id, self.products[0].id, 1)
+        Cart.objects.filter(pk=self.cart.pk).refresh_totals()
+        # Another request changes the quantity after this one read the item.
+        self.client.patch(self.items_path(item.id), {'quantity': 3})
+        serializer = UpdateCartItemSerializer(item, data={'quantity': 5})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertTotals(5, '54.50')
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Checkout')
+        cls.products = [
+            Product.objects.create(
+                name=f'Checkout Product {i}', slug=f'checkout-product-{i}', category=category,
+                unit_price=Decimal('10.00'), inventory=5,
+            ) for i in range(6)
+        ]
+        cls.user = benchmarks.benchmark_user('checkout-user')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def cart(self, quantities):
+        cart = Cart.objects.create()
+        for product, quantity in zip(self.products, quantities):
+            self.client.post(f'/store/carts/{cart.id}/items/', {'product': product.id, 'quantity': quantity})
+        return cart
+
+    def test_stock_is_reserved(self):
+        cart = self.cart([2, 5])
+        response = self.client.post('/store/orders/', {'cart_id': cart.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[self.products[0].pk, self.products[1].pk]).order_by('pk').values_list('inventory', flat=True)),
+            [3, 0],
+        )
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual(
+            set(order.items.values_list('product', 'quantity', 'unit_price')),
+            {(self.products[0].id, 2, Decimal('10.90')), (self.products[1].id, 5, Decimal('10.90'))},
+        )
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_out_of_stock_products_are_reported_and_nothing_is_taken(self):
+        cart = self.cart([1, 6, 7])
+        response = self.client.post('/store/orders/', {'cart_id': cart.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'out_of_stock': {
+            str(self.products[1].id): 'Only 5 left in stock, 6 requested.',
+            str(self.products[2].id): 'Only 5 left in stock, 7 requested.',
+        }})
+        self.assertEqual(set(Product.objects.values_list('inventory', flat=True)), {5})
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_a_cart_checked_out_meanwhile_is_not_ordered_again(self):
+        cart = self.cart([1])
+        serializer = OrderCreateSerializer(data={'cart_id': cart.id}, context={'user_id': self.user.id})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(self.client.post('/store/orders/', {'cart_id': cart.id}).status_code, 200)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).inventory, 4)
+
+    def test_query_count_does_not_grow_with_cart_lines(self):
+        counts = []
+        for quantities in [[1], [1] * 6]:
+            cart = self.cart(quantities)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post('/store/orders/', {'cart_id': cart.id}).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cart_is_deleted_without_loading_it(self):
+        cart = self.cart([1, 1])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post('/store/orders/', {'cart_id': cart.id}).status_code, 200)
+        statements = [query['sql'] for query in queries]
+        # Validating and locking the cart are its only reads.
+        self.assertEqual(len([sql for sql in statements if sql.startswith('SELECT') and 'FROM "store_cart" ' in sql]), 2)
+        first_delete = next(i for i, sql in enumerate(statements) if sql.startswith('DELETE'))
+        deletes = statements[first_delete:first_delete + 2]
+        self.assertIn('store_cartitem', deletes[0])
+        self.assertTrue(deletes[1].startswith('DELETE FROM "store_cart" '), deletes[1])
+        self.assertFalse([sql for sql in statements[first_delete + 2:] if 'store_cart' in sql])
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+
+class OutboxTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('In-memory SQLite cannot be shared between threads.')
+        self.user = benchmarks.benchmark_user('outbox-user')
+        self.order = Order.objects.create(customer=self.user.customer)
+        self.received = []
+        # Only the receivers of the test, not the app's own.
+        patcher = mock.patch.object(order_created, 'receivers', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        order_created.connect(self.receive, weak=False)
+
+    def receive(self, sender, order, **kwargs):
+        self.received.append(order.id)
+
+    def test_publish_is_rolled_back_with_its_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.publish('order_created', order_id=self.order.id)
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_claimed_events_are_leased(self):
+        events = [outbox.publish('order_created', order_id=self.order.id) for _ in range(3)]
+        OutboxEvent.objects.filter(pk=events[2].pk).update(available_at=timezone.now() + timedelta(minutes=1))
+        lease = timedelta(minutes=5)
+        self.assertEqual([event.pk for event in outbox.claim_events(1, lease)], [events[0].pk])
+        self.assertEqual([event.pk for event in outbox.claim_events(10, lease)], [events[1].pk])
+        self.assertEqual(outbox.claim_events(10, lease), [])
+        leased_until = OutboxEvent.objects.get(pk=events[0].pk).available_at
+        self.assertGreater(leased_until, timezone.now() + timedelta(minutes=4))
+
+        # A worker that died holding the lease releases the event once it runs out.
+        OutboxEvent.objects.filter(pk=events[0].pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([event.pk for event in outbox.claim_events(10, lease)], [events[0].pk])
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        order_created.connect(self.fail, weak=False)
+        event = outbox.publish('order_created', order_id=self.order.id)
+        for attempts, delay, status in [(1, 2, 'p'), (2, 4, 'p'), (3, 5, 'f')]:
+            start = timezone.now()
+            self.assertFalse(outbox.process_event(OutboxEvent.objects.get(pk=event.pk), 3, 2, 5))
+            event.refresh_from_db()
+            self.assertEqual((event.attempts, event.status), (attempts, status))
+            self.assertAlmostEqual((event.available_at - start).total_seconds(), delay, delta=1)
+            self.assertIn('ValueError', event.last_error)
+
+    def fail(self, sender, **kwargs):
+        raise ValueError('receiver failed')
+
+    def test_checkout_events_are_dispatched_by_the_command(self):
+        category = Category.objects.create(title='Outbox')
+        product = Product.objects.create(
+            name='Outbox Product', slug='outbox-product', category=category, unit_price=1, inventory=1,
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        cart = Cart.objects.create()
+        client.post(f'/store/carts/{cart.id}/items/', {'product': product.id, 'quantity': 1})
+        order_id = client.post('/store/orders/', {'cart_id': cart.id}).json()['id']
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event, event.payload), ('order_created', {'order_id': order_id}))
+
+        out = StringIO()
+        call_command('process_outbox', '--once', '--workers', '2', stdout=out)
+        self.assertEqual(out.getvalue(), '1 events dispatched, 0 failed\n')
+        self.assertEqual(self.received, [order_id])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_DONE, 1))
+        self.assertIsNotNone(event.processed_at)
+
+
+class IndexUsageTests(TestCase):
+    """Runs the hot API requests and checks the plan of every SELECT they issue."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Laptop')
+        cls.category = category
+        cls.product = Product.objects.create(
+            name='Gaming Laptop', slug='gaming-laptop', category=category,
+            description='', unit_price=Decimal('12.50'), inventory=5,
+        )
+        Comment.objects.create(product=cls.product, name='Ali', body='Nice', status=Comment.COMMENT_STATUS_APPROVED)
+        cls.user = get_user_model().objects.create_user(username='buyer', password='secret')
+        Order.objects.create(customer=cls.user.customer)
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked with SQLite EXPLAIN QUERY PLAN.')
+        self.client = APIClient()
+
+    def query_plans(self, path, user=None):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append(' '.join(row[-1] for row in cursor.fetchall()))
+        return plans
+
+    def assertUsesIndex(self, path, index, user=None):
+        plans = self.query_plans(path, user)
+        self.assertTrue(any(index in plan for plan in plans), f'{index} not used by {path}: {plans}')
+
+    def test_product_ordering_uses_indexes(self):
+        self.assertUsesIndex('/store/products/?ordering=unit_price', 'store_product_price_idx')
+        self.assertUsesIndex('/store/products/?ordering=name&pagination=keyset', 'store_product_name_idx')
+
+    def test_product_category_ordering_uses_composite_index(self):
+        plan = Product.objects.filter(category=self.category).order_by('unit_price', 'id').explain()
+        self.assertIn('store_product_cat_price_idx', plan)
+
+    def test_product_inventory_filter_uses_index(self):
+        self.assertUsesIndex('/store/products/?inventory__lt=10', 'store_product_inventory_idx')
+
+    def test_product_filters_use_indexes(self):
+        for path, index in [
+            ('/store/products/?unit_price__gte=10&unit_price__lte=20', 'store_product_price_idx'),
+            ('/store/products/?effective_price__gte=10&effective_price__lte=20', 'store_product_eff_price_idx'),
+            # Either the foreign key index or the category/price one.
+            (f'/store/products/?category__in={self.category.id},0', '(category_id=?)'),
+            ('/store/products/?in_stock=true', 'store_product_inventory_idx'),
+            ('/store/products/?datetime_created__gte=2020-01-01T00:00:00Z', 'store_product_created_idx'),
+        ]:
+            with self.subTest(path=path):
+                self.assertUsesIndex(path, index)
+
+    def test_product_comments_use_index(self):
+        self.assertUsesIndex(f'/store/products/{self.product.id}/comments/', 'store_comment_product_idx')
+
+    def test_customer_orders_use_index(self):
+        self.assertUsesIndex('/store/orders/?ordering=-datetime_created', 'store_order_customer_idx', self.user)
+
+    def test_unpaid_orders_use_status_index(self):
+        plan = Order.unpaid_orders.order_by('datetime_created').explain()
+        self.assertIn('store_order_status_idx', plan)
+
+
+class EndpointQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=30, orders=12)
+
+    def test_endpoints_stay_within_query_budget(self):
+        results = benchmarks.run(self.seeded, repeat=1)
+        for endpoint in benchmarks.ENDPOINTS:
+            for role, result in results[endpoint.name].items():
+                with self.subTest(endpoint=endpoint.name, role=role):
+                    self.assertTrue(200 <= result['status'] < 300, result)
+                    self.assertLessEqual(result['queries'], endpoint.max_queries)
+
+    def test_rows_are_counted_from_the_cursor(self):
+        endpoints = [endpoint for endpoint in benchmarks.ENDPOINTS if endpoint.name == 'cart-item-list']
+        result = benchmarks.run(self.seeded, repeat=1, endpoints=endpoints, roles=['anonymous'])
+        self.assertEqual(result['cart-item-list']['anonymous']['rows'], 20)
+
+    def test_query_count_does_not_grow_with_data(self):
+        before = benchmarks.run(self.seeded, repeat=1, roles=['staff'])
+        benchmarks.seed(products=30, orders=12, items_per_order=10)
+        after = benchmarks.run(self.seeded, repeat=1, roles=['staff'])
+        for name, result in before.items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(after[name]['staff']['queries'], result['staff']['queries'])
+
+    def test_command_fails_on_rejected_requests(self):
+        endpoints = [benchmarks.Endpoint('missing', '/store/missing/', 1, roles=('anonymous',))]
+        with mock.patch.object(benchmarks, 'ENDPOINTS', endpoints), tempfile.NamedTemporaryFile(suffix='.json') as output:
+            with self.assertRaisesMessage(CommandError, 'missing (anonymous): HTTP 404'):
+                call_command(
+                    'benchmark_endpoints', '--products', '3', '--orders', '1', '--repeat', '1',
+                    '--output', output.name, stdout=StringIO(),
+                )
+
+
+class ValuesSerializerParityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=15, orders=5)
+        Customer.objects.update(birth_date=date(1990, 5, 17))
+        get_user_model().objects.update(first_name='Sara')
+        Product.objects.filter(pk=cls.seeded['params']['product']).update(unit_price=Decimal('1234.05'))
+
+    def assertRendersSame(self, serializer_class, queryset, values_serializer_class):
+        expected = serializer_class(queryset, many=True).data
+        reader = values_serializer_class()
+        rows = reader.prefetch(list(reader.get_values(queryset)))
+        actual = values_serializer_class(rows, many=True).data
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def order_queryset(self):
+        return Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+        ).select_related('customer__user').order_by('id')
+
+    def test_products(self):
+        self.assertRendersSame(ProductSerializer, Product.objects.order_by('id'), ProductValuesSerializer)
+
+    def test_orders_for_user(self):
+        self.assertRendersSame(OrderForUserSerializer, self.order_queryset(), OrderForUserValuesSerializer)
+
+    def test_orders_for_admin(self):
+        self.assertRendersSame(OrderForAdminSerializer, self.order_queryset(), OrderForAdminValuesSerializer)
+
+    def test_list_endpoints_use_values_serializers(self):
+        client = APIClient()
+        response = client.get('/store/products/?ordering=name')
+        expected = ProductSerializer(Product.objects.order_by('name', 'id')[:10], many=True).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+
+        client.force_authenticate(self.seeded['users']['staff'])
+        response = client.get('/store/orders/?ordering=id')
+        expected = OrderForAdminSerializer(self.order_queryset(), many=True).data
+        self.assertEqual(response.json(), json.loads(JSONRenderer().render(expected)))
+
+
+class SerializerColumnPruningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=5, orders=2)
+
+    def assertColumnsNotLoaded(self, path, columns, user=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            for column in columns:
+                self.assertNotIn(column, query['sql'])
+
+    def test_cart_loads_only_rendered_product_columns(self):
+        cart = self.seeded['params']['cart']
+        self.assertColumnsNotLoaded(f'/store/carts/{cart}/', ['"description"', '"slug"', '"inventory"'])
+        self.assertColumnsNotLoaded(f'/store/carts/{cart}/items/', ['"description"', '"slug"', '"inventory"'])
+
+    def test_order_detail_loads_only_rendered_columns(self):
+        order = self.seeded['params']['order']
+        self.assertColumnsNotLoaded(
+            f'/store/orders/{order}/', ['"description"', '"password"', '"phone_number"'], self.seeded['users']['staff'],
+        )
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=12, orders=3)
+
+    def get(self, path, user=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        return response, ' '.join(query['sql'] for query in queries.captured_queries)
+
+    def test_product_fields_are_pushed_down(self):
+        product = self.seeded['params']['product']
+        for path in ['/store/products/?fields=id,title,price', f'/store/products/{product}/?fields=id,title,price']:
+            response, sql = self.get(path)
+            results = response.json()['results'] if 'results' in response.json() else [response.json()]
+            self.assertEqual(list(results[0]), ['id', 'title', 'price'])
+            self.assertNotIn('"description"', sql)
+
+    def test_product_category_expansion(self):
+        response, sql = self.get('/store/products/?fields=id,category&expand=category')
+        row = response.json()['results'][0]
+        category = Product.objects.select_related('category').get(pk=row['id']).category
+        self.assertEqual(row['category'], {'id': category.id, 'title': category.title})
+        self.assertIn('"store_category"."title"', sql)
+
+    def test_order_items_are_not_prefetched_unless_expanded(self):
+        user = self.seeded['users']['user']
+        order = self.seeded['params']['order']
+        for path in ['/store/orders/?fields=id,status', '/store/orders/?expand=', f'/store/orders/{order}/?expand=']:
+            response, sql = self.get(path, user)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('store_orderitem', sql)
+        response, sql = self.get('/store/orders/', user)
+        self.assertIn('items', response.json()[0])
+
+    def test_plans_are_shared_by_permutations_and_repetitions(self):
+        get_plan.cache_clear()
+        for fields in ['id,title', 'title,id', 'id,id,title,id', 'title,title,id']:
+            self.assertEqual(self.get(f'/store/products/{self.seeded["params"]["product"]}/?fields={fields}')[0].status_code, 200)
+        self.assertEqual(get_plan.cache_info().currsize, 1)
+        self.assertIsNotNone(get_plan.cache_info().maxsize)
+
+    def test_unknown_fields_are_rejected(self):
+        response, _ = self.get('/store/products/?fields=id,secret&expand=description')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'fields', 'expand'})
+
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptops = Category.objects.create(title='Laptops')
+        cls.bags = Category.objects.create(title='Bags')
+        cls.products = {
+            name: Product.objects.create(
+                name=name, slug=f'search-{i}', category=category, unit_price=Decimal(1), inventory=1,
+            ) for i, (name, category) in enumerate([
+                ('Gaming Laptop Pro', cls.laptops),
+                ('Laptop Bag', cls.bags),
+                ('Quartz Watch Model 9', cls.bags),
+            ])
+        }
+
+    def search(self, text):
+        return [row['title'] for row in APIClient().get('/store/products/', {'search': text}).json()['results']]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('Gaming-Laptop, PRO 15"'), ['gaming', 'laptop', 'pro', '15'])
+        self.assertEqual(search.tokenize('x' * 100), ['x' * 64])
+        self.assertEqual(search.tokenize(' ,.'), [])
+
+    def test_products_are_indexed_with_name_and_category_tokens(self):
+        tokens = dict(self.products['Laptop Bag'].search_tokens.values_list('token', 'weight'))
+        self.assertEqual(tokens, {'laptop': search.NAME_WEIGHT, 'bag': search.NAME_WEIGHT, 'bags': search.CATEGORY_WEIGHT})
+
+    def test_rebuild_replaces_tokens_batch_by_batch(self):
+        laptop = self.products['Gaming Laptop Pro']
+        laptop.search_tokens.all().delete()
+        ProductSearchToken.objects.create(product=laptop, token='stale')
+        found = []
+
+        def searchable(*args, **kwargs):
+            # After each batch, reindexed or not, every product still matches.
+            created = bulk_create(*args, **kwargs)
+            found.append(search.search_products(Product.objects.all(), 'bag').count())
+            return created
+
+        bulk_create = ProductSearchToken.objects.bulk_create
+        with mock.patch.object(search, 'BATCH_SIZE', 1), \
+                mock.patch.object(ProductSearchToken.objects, 'bulk_create', side_effect=searchable):
+            search.rebuild_index()
+        self.assertEqual(found, [2, 2, 2])
+        self.assertEqual(set(laptop.search_tokens.values_list('token', flat=True)), {'gaming', 'laptop', 'pro', 'laptops'})
+
+    def test_every_term_matches_a_token_prefix(self):
+        self.assertEqual(self.search('lap gam'), ['Gaming Laptop Pro'])
+        self.assertEqual(self.search('LAPTOPS'), ['Gaming Laptop Pro'])
+        self.assertEqual(self.search('laptop watch'), [])
+        # Terms ending in the last letter or digit.
+        self.assertEqual(self.search('quartz'), ['Quartz Watch Model 9'])
+        self.assertEqual(self.search('9'), ['Quartz Watch Model 9'])
+
+    def test_like_wildcards_are_literal(self):
+        self.assertEqual(self.search('l_ptop'), [])
+
+    def test_results_are_ranked_by_matching_token_weight(self):
+        # A name match outweighs a category match.
+        self.assertEqual(self.search('laptop'), ['Gaming Laptop Pro', 'Laptop Bag'])
+        self.assertEqual(self.search('bag'), ['Laptop Bag', 'Quartz Watch Model 9'])
+
+
+class ProductBulkImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Bulk')
+        cls.staff = benchmarks.benchmark_user('bulk-staff', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def row(self, i, **fields):
+        return {
+            'title': f'Bulk Product {i}', 'price': '12.50', 'category': self.category.id,
+            'inventory': 3, 'description': '', **fields,
+        }
+
+    def test_json_rows_are_created_and_indexed(self):
+        response = self.client.post('/store/products/bulk/', [self.row(i) for i in range(25)], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'created': 25, 'updated': 0})
+        products = Product.objects.filter(category=self.category)
+        self.assertEqual(products.count(), 25)
+        self.assertEqual(products.filter(search_tokens__token='bulk').count(), 25)
+
+    def test_ndjson_rows_update_products(self):
+        product = Product.objects.create(
+            name='Old Product', slug='old-product', category=self.category, unit_price=1, inventory=1,
+        )
+        body = '\n'.join(json.dumps(row) for row in [self.row(1, id=product.id), self.row(2)])
+        response = self.client.post('/store/products/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.json(), {'created': 1, 'updated': 1})
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.unit_price), ('Bulk Product 1', Decimal('12.50')))
+
+    def test_invalid_rows_write_nothing(self):
+        rows = [self.row(1), self.row(2, category=0), self.row(3, title='x'), self.row(4, id=0)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/store/products/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['category'])
+        self.assertEqual(list(errors[2]), ['title'])
+        self.assertEqual(list(errors[3]), ['id'])
+        self.assertFalse(Product.objects.filter(category=self.category).exists())
+        self.assertFalse(any(query['sql'].startswith('INSERT') for query in queries.captured_queries))
+
+    def test_bad_ndjson_line_is_reported(self):
+        body = json.dumps(self.row(1)) + '\n{not json\n'
+        response = self.client.post('/store/products/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 2', response.json()['detail'])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=25, orders=5, items_per_order=2)
+
+    def export(self, path, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.seeded['users']['staff'])
+        response = client.get(path)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content.decode()
+
+    def test_products_are_streamed_in_chunks(self):
+        Product.objects.filter(category_id=self.seeded['params']['category']).update(inventory=0)
+        with mock.patch.object(ProductViewSet, 'export_chunk_size', 4), \
+                CaptureQueriesContext(connection) as queries:
+            response, content = self.export('/store/products/export/?inventory__lt=1')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in content.splitlines()]
+        expected = list(Product.objects.filter(inventory=0).order_by('pk').values_list('pk', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+        self.assertEqual(rows[0], json.loads(JSONRenderer().render(ProductSerializer(Product.objects.get(pk=expected[0])).data)))
+        selects = [query for query in queries.captured_queries if 'store_product' in query['sql']]
+        # One query per chunk, the last one short or empty.
+        self.assertEqual(len(selects), len(expected) // 4 + 1)
+
+    def test_orders_csv(self):
+        response, content = self.export('/store/orders/export/?format=csv&fields=id,customer,status')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,customer.id,customer.first_name,customer.birth_date,status')
+        self.assertEqual(len(lines), 1 + Order.objects.count())
+
+    def test_export_is_staff_only(self):
+        response, _ = self.export('/store/orders/export/', self.seeded['users']['user'])
+        self.assertEqual(response.status_code, 403)
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Rollup')
+        cls.products = [
+            Product.objects.create(
+                name=f'Rollup Product {i}', slug=f'rollup-product-{i}', category=cls.category,
+                unit_price=Decimal('2.50') * (i + 1), inventory=100,
+            ) for i in range(2)
+        ]
+        cls.user = benchmarks.benchmark_user('rollup-user')
+        cls.staff = benchmarks.benchmark_user('rollup-staff', is_staff=True)
+
+    def checkout(self, quantities):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        cart = Cart.objects.create()
+        for product, quantity in zip(self.products, quantities):
+            if quantity:
+                client.post(f'/store/carts/{cart.id}/items/', {'product': product.id, 'quantity': quantity})
+        return Order.objects.get(pk=client.post('/store/orders/', {'cart_id': cart.id}).json()['id'])
+
+    def sales(self):
+        return {
+            'products': set(ProductDailySales.objects.values_list('product', 'status', 'units', 'revenue', 'orders')),
+            'categories': set(CategoryDailySales.objects.values_list('category', 'status', 'units', 'revenue', 'orders')),
+        }
+
+    def test_orders_are_rolled_up_as_they_are_placed_and_updated(self):
+        first, second = self.products
+        order = self.checkout([1, 2])
+        self.checkout([3, 0])
+        self.assertEqual(self.sales(), {
+            'products': {
+                (first.id, 'u', 4, Decimal('10.92'), 2),
+                (second.id, 'u', 2, Decimal('10.90'), 1),
+            },
+            'categories': {(self.category.id, 'u', 6, Decimal('21.82'), 2)},
+        })
+
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        client.patch(f'/store/orders/{order.id}/', {'status': Order.ORDER_STATUS_PAID})
+        incremental = self.sales()
+        self.assertIn((self.category.id, 'p', 3, Decimal('13.63'), 1), incremental['categories'])
+        self.assertIn((self.category.id, 'u', 3, Decimal('8.19'), 1), incremental['categories'])
+        self.assertIn((second.id, 'u', 0, Decimal('0.00'), 0), incremental['products'])
+
+        rollups.rebuild()
+        rebuilt = self.sales()
+        self.assertEqual(rebuilt['categories'], incremental['categories'])
+        self.assertEqual(rebuilt['products'], {row for row in incremental['products'] if row[-1]})
+
+    def test_recording_an_order_takes_the_same_queries_for_any_number_of_lines(self):
+        other = Category.objects.create(title='Other Rollup')
+        extra = [
+            Product.objects.create(
+                name=f'Other Product {i}', slug=f'other-product-{i}', category=other, unit_price=Decimal(1), inventory=1,
+            ) for i in range(3)
+        ]
+        counts = []
+        for products in [self.products[:1], self.products + extra]:
+            order = Order.objects.create(customer=self.user.customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price) for product in products
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                rollups.record_order(order)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.sales()['categories'], {
+            (self.category.id, 'u', 3, Decimal('10.00'), 2),
+            (other.id, 'u', 3, Decimal('3.00'), 1),
+        })
+
+    def place(self, quantities):
+        """An order created without going through the rollups, as before they existed."""
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, unit_price=product.unit_price)
+            for product, quantity in zip(self.products, quantities) if quantity
+        ])
+        return order
+
+    def test_migration_backfills_existing_orders(self):
+        self.place([1, 2])
+        ProductDailySales.objects.all().delete()
+        CategoryDailySales.objects.all().delete()
+        import_module('store.migrations.0022_daily_sales_rollups').fill_rollups(django_apps, None)
+        backfilled = self.sales()
+        rollups.rebuild()
+        self.assertEqual(backfilled, self.sales())
+        self.assertEqual(backfilled['categories'], {(self.category.id, 'u', 3, Decimal('12.50'), 1)})
+
+    def test_totals_do_not_go_below_zero(self):
+        order = self.place([1, 2])
+        order.status = Order.ORDER_STATUS_PAID
+        order.save()
+        sales = self.sales()
+        self.assertIn((self.category.id, 'u', 0, Decimal('0.00'), 0), sales['categories'])
+        self.assertIn((self.category.id, 'p', 3, Decimal('12.50'), 1), sales['categories'])
+
+    def test_admin_item_edits_apply_the_order_deltas(self):
+        first, second = self.products
+        order = self.checkout([1, 2])
+        self.checkout([1, 0])
+        item = order.items.get(product=first)
+        client = APIClient()
+        client.force_login(benchmarks.benchmark_user('rollup-admin', is_staff=True, is_superuser=True))
+        with mock.patch.object(rollups, 'rebuild') as rebuild:
+            response = client.post(f'/admin/store/order/{order.id}/change/', {
+                'customer': order.customer_id, 'status': order.status,
+                'items-TOTAL_FORMS': 2, 'items-INITIAL_FORMS': 2, 'items-MIN_NUM_FORMS': 1, 'items-MAX_NUM_FORMS': 10,
+                'items-0-id': item.id, 'items-0-order': order.id, 'items-0-product': first.id,
+                'items-0-quantity': 5, 'items-0-unit_price': item.unit_price,
+                'items-1-id': order.items.get(product=second).id, 'items-1-order': order.id, 'items-1-DELETE': 'on',
+                'items-1-product': second.id, 'items-1-quantity': 2, 'items-1-unit_price': second.unit_price,
+            })
+        self.assertEqual(response.status_code, 302)
+        rebuild.assert_not_called()
+        incremental = self.sales()
+        revenue = 6 * item.unit_price
+        self.assertIn((first.id, 'u', 6, revenue, 2), incremental['products'])
+        self.assertIn((second.id, 'u', 0, Decimal('0.00'), 0), incremental['products'])
+        self.assertIn((self.category.id, 'u', 6, revenue, 2), incremental['categories'])
+        rollups.rebuild()
+        self.assertEqual(self.sales()['categories'], incremental['categories'])
+
+    def test_report_reads_only_the_rollups(self):
+        self.checkout([1, 1])
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'/store/sales/?category={self.category.id}')
+        self.assertEqual(response.json(), [{
+            'day': date.today().isoformat(), 'category': self.category.id, 'units': 2, 'revenue': 8.18,
+            'orders': {'paid': 0, 'unpaid': 1, 'canceled': 0},
+        }])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('store_orderitem', queries[0]['sql'])
+
+
+class EffectivePriceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Pricing')
+        cls.product = Product.objects.create(
+            name='Priced Product', slug='priced-product', category=category, unit_price=Decimal('10.00'), inventory=5,
+        )
+        cls.other = Product.objects.create(
+            name='Other Product', slug='other-product', category=category, unit_price=Decimal('20.00'), inventory=5,
+        )
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=cls.product, quantity=2)
+        Cart.objects.filter(pk=cls.cart.pk).refresh_totals()
+
+    def assertPrices(self, effective_price, cart_total):
+        self.product.refresh_from_db()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.product.effective_price, Decimal(effective_price))
+        self.assertEqual(self.cart.total_price, Decimal(cart_total))
+
+    def test_prices_follow_products_and_discounts(self):
+        self.assertPrices('10.90', '21.80')
+        small, large = Discount.objects.create(discount=0.1, description='Small'), \
+            Discount.objects.create(discount=0.5, description='Large')
+        self.product.discounts.add(small)
+        self.assertPrices('9.81', '19.62')
+        large.products.add(self.product, self.other)
+        self.assertPrices('5.45', '10.90')
+        large.discount = 0.2
+        large.save()
+        self.assertPrices('8.72', '17.44')
+        large.delete()
+        self.assertPrices('9.81', '19.62')
+        self.product.unit_price = Decimal('20.00')
+        self.product.save()
+        self.assertPrices('19.62', '39.24')
+        small.products.clear()
+        self.assertPrices('21.80', '43.60')
+
+    def test_products_sort_and_filter_on_effective_price(self):
+        self.product.discounts.add(Discount.objects.create(discount=0.5, description='Half'))
+        response = APIClient().get('/store/products/?ordering=-effective_price&effective_price__lt=25')
+        self.assertEqual(
+            [(row['id'], row['effective_price']) for row in response.json()['results']],
+            [(self.other.id, 21.8), (self.product.id, 5.45)],
+        )
+
+    def test_checkout_charges_effective_prices(self):
+        self.product.discounts.add(Discount.objects.create(discount=0.5, description='Half'))
+        client = APIClient()
+        client.force_authenticate(benchmarks.benchmark_user('pricing-user'))
+        order = client.post('/store/orders/', {'cart_id': self.cart.id}).json()
+        self.assertEqual([item['unit_price'] for item in order['items']], [5.45])
+
+
+    def test_discounts_are_fractions(self):
+        with self.assertRaises(DjangoValidationError):
+            Discount(discount=42.65, description='Percentage').full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Discount.objects.create(discount=-0.1, description='Negative')
+
+class ProductFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(title=f'Facet {i}') for i in range(2)]
+        for i, price in enumerate(['5', '9.99', '10', '30', '2000']):
+            Product.objects.create(
+                name=f'Facet Product {i}', slug=f'facet-product-{i}', category=cls.categories[i % 2],
+                unit_price=Decimal(price), inventory=i,
+            )
+
+    def test_facets_are_counted_in_one_query_alongside_the_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            plain = APIClient().get('/store/products/?in_stock=true')
+        with CaptureQueriesContext(connection) as faceted_queries:
+            response = APIClient().get('/store/products/?in_stock=true&facets=category,price')
+        self.assertEqual(len(faceted_queries), len(queries) + 1)
+        body = response.json()
+        self.assertEqual(body['results'], plain.json()['results'])
+        first, second = self.categories
+        self.assertEqual(body['facets']['category'], [
+            {'id': first.id, 'title': 'Facet 0', 'count': 2},
+            {'id': second.id, 'title': 'Facet 1', 'count': 2},
+        ])
+        self.assertEqual([bucket['count'] for bucket in body['facets']['price']], [1, 1, 1, 0, 0, 0, 0, 1])
+        self.assertEqual(body['facets']['price'][-1], {'min': 1000, 'max': None, 'count': 1})
+
+    def test_unknown_facets_are_rejected(self):
+        response = APIClient().get('/store/products/?facets=colour')
+        self.assertEqual(response.status_code, 400)
+
+
+class CommentStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Comments')
+        cls.product, cls.other = [
+            Product.objects.create(
+                name=f'Commented Product {i}', slug=f'commented-product-{i}', category=category,
+                unit_price=Decimal('1.00'), inventory=1,
+            ) for i in range(2)
+        ]
+
+    def comment(self, status=Comment.COMMENT_STATUS_APPROVED, product=None):
+        return Comment.objects.create(product=product or self.product, name='Sara', body='Good', status=status)
+
+    def assertStats(self, count, comment=None):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.approved_comment_count, count)
+        self.assertEqual(self.product.last_comment_at, comment and comment.datetime_created)
+
+    def test_stats_follow_comment_status(self):
+        first = self.comment()
+        waiting = self.comment(Comment.COMMENT_STATUS_WAITING)
+        self.assertStats(1, first)
+
+        waiting.status = Comment.COMMENT_STATUS_APPROVED
+        waiting.save()
+        self.assertStats(2, waiting)
+
+        # A comment loaded without its status still refreshes the stats.
+        deferred = Comment.objects.only('id', 'body').get(pk=waiting.pk)
+        deferred.status = Comment.COMMENT_STATUS_NOT_APPROVED
+        deferred.save()
+        self.assertStats(1, first)
+
+        first.product = self.other
+        first.save()
+        self.assertStats(0)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.approved_comment_count, 1)
+
+        self.comment().delete()
+        self.assertStats(0)
+
+    def test_feed_pages_through_approved_comments_newest_first(self):
+        approved = [self.comment() for _ in range(25)]
+        self.comment(Comment.COMMENT_STATUS_WAITING)
+        client = APIClient()
+        first_page = client.get(f'/store/products/{self.product.id}/comments/').json()
+        second_page = client.get(first_page['next']).json()
+        ids = [comment['id'] for comment in first_page['results'] + second_page['results']]
+        self.assertEqual(ids, [comment.id for comment in reversed(approved)])
+        self.assertIsNone(second_page['next'])
+
+    def test_cached_feed_is_invalidated_by_comment_changes(self):
+        path = f'/store/products/{self.product.id}/comments/'
+        client = APIClient()
+        client.get(path)
+        self.assertEqual(client.get(path)['X-Cache'], 'HIT')
+        comment = self.comment()
+        response = client.get(path)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([row['id'] for row in response.json()['results']], [comment.id])
+
+
+
+class ProductResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Cached')
+        cls.product = Product.objects.create(
+            name='Cached Product', slug='cached-product', category=cls.category, unit_price=Decimal('5.00'), inventory=3,
+        )
+
+    def setUp(self):
+        product_cache.invalidate()
+        self.client = APIClient()
+
+    def test_product_changes_invalidate_cached_responses(self):
+        for path in ['/store/products/', f'/store/products/{self.product.id}/']:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+                self.assertEqual(self.client.get(path)['X-Cache'], 'HIT')
+                self.product.inventory = 7
+                self.product.save()
+                response = self.client.get(path)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertIn('"inventory":7', response.content.decode())
+
+    def test_category_and_discount_changes_invalidate_cached_responses(self):
+        path = '/store/products/'
+        for change in [
+            lambda: Category.objects.get(pk=self.category.pk).save(),
+            lambda: self.product.discounts.add(Discount.objects.create(discount=0.5, description='Half')),
+        ]:
+            self.client.get(path)
+            change()
+            self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+
+    def test_evicted_version_does_not_revive_old_responses(self):
+        path = '/store/products/'
+        self.client.get(path)
+        old_version = product_cache.get_version()
+        product_cache.cache.delete(product_cache.version_key)
+        self.assertNotEqual(product_cache.get_version(), old_version)
+        self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example.com'])
+    def test_hosts_are_cached_apart(self):
+        self.client.get('/store/products/?page=1')
+        response = self.client.get('/store/products/?page=1', HTTP_HOST='shop.example.com')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_stats_are_reported_to_staff(self):
+        self.client.get('/store/products/')
+        self.client.get('/store/products/')
+        self.assertEqual(self.client.get('/store/cache-stats/').status_code, 401)
+        self.client.force_authenticate(benchmarks.benchmark_user('cache-staff', is_staff=True))
+        stats = self.client.get('/store/cache-stats/').json()
+        self.assertEqual(set(stats), {'products', 'comments'})
+        self.assertEqual(stats['products']['version'], product_cache.get_version())
+        self.assertGreaterEqual(stats['products']['hits'], 1)
+
+
+
+class ProductConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Conditional')
+        cls.product = Product.objects.create(
+            name='Conditional Product', slug='conditional-product', category=category,
+            unit_price=Decimal('5.00'), inventory=3,
+        )
+
+    def setUp(self):
+        product_cache.invalidate()
+        self.client = APIClient()
+
+    def test_list_validators_cost_no_queries(self):
+        response = self.client.get('/store/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertEqual(response['Last-Modified'], http_date(product_cache.get_last_modified().timestamp()))
+        with self.assertNumQueries(0):
+            response = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get('/store/products/')['Last-Modified']
+        response = self.client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_changes_change_the_validators(self):
+        etag = self.client.get('/store/products/')['ETag']
+        self.product.inventory = 0
+        self.product.save()
+        response = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(self.client.get('/store/products/?ordering=name')['ETag'], response['ETag'])
+
+    def test_detail(self):
+        path = f'/store/products/{self.product.id}/'
+        response = self.client.get(path)
+        self.assertEqual(response['Last-Modified'], http_date(self.product.datetime_modified.timestamp()))
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Product.objects.filter(pk=self.product.pk).update(datetime_modified=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+    def test_detail_with_expanded_category(self):
+        path = f'/store/products/{self.product.id}/?expand=category'
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        category = self.product.category
+        category.title = 'Renamed'
+        category.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['category']['title'], 'Renamed')
+        path = f'/store/products/{self.product.id}/'
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=self.client.get(path)['ETag']).status_code, 304)
+
+    def test_category_validators_cost_no_queries(self):
+        for path in ['/store/categories/', f'/store/categories/{self.product.category_id}/']:
+            with self.subTest(path=path):
+                etag = self.client.get(path)['ETag']
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                Product.objects.create(
+                    name='Another Product', slug='another-product', category=self.product.category,
+                    unit_price=Decimal('1.00'), inventory=1,
+                )
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+
+class PurgeCartsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Carts')
+        cls.product = Product.objects.create(
+            name='Cart Product', slug='cart-product', category=category, unit_price=Decimal('1.00'), inventory=10,
+        )
+
+    def cart(self, days_idle):
+        cart = Cart.objects.create(last_activity=timezone.now() - timedelta(days=days_idle))
+        CartItem.objects.create(cart=cart, product=self.product)
+        return cart
+
+    def test_item_changes_mark_carts_active(self):
+        cart = self.cart(40)
+        APIClient().post(f'/store/carts/{cart.id}/items/', {'product': self.product.id, 'quantity': 1})
+        cart.refresh_from_db()
+        self.assertGreater(cart.last_activity, timezone.now() - timedelta(minutes=1))
+
+    def test_expired_carts_are_deleted_in_batches(self):
+        expired = [self.cart(40) for _ in range(3)]
+        active = self.cart(5)
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_carts', '--older-than', '30d', '--batch-size', '2', '-v', '2', stdout=out)
+        self.assertEqual(list(Cart.objects.all()), [active])
+        self.assertEqual(CartItem.objects.count(), 1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[:2], ['Deleted 2 carts and 2 items', 'Deleted 1 carts and 1 items'])
+        self.assertTrue(lines[2].startswith('Deleted 3 carts and 3 items'))
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE FROM "store_cart"')]
+        self.assertEqual(len(deletes), 2)
+        self.assertNotIn(str(active.id).replace('-', ''), ' '.join(deletes))
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in expired]).exists())
+
+
+
+class GenerateFakeDataTests(TestCase):
+    def test_small_run(self):
+        Product.objects.create(
+            name='Old Product', slug='old-product', category=Category.objects.create(title='Old'), unit_price=1, inventory=1,
+        )
+        with redirect_stdout(StringIO()):
+            call_command(
+                'generate_fake_data', '--categories=3', '--discounts=2', '--products=12', '--customers=4',
+                '--orders=5', '--carts=3', '--batch-size=5', stdout=StringIO(),
+            )
+        self.assertEqual(
+            [model.objects.count() for model in (Category, Discount, Product, Customer, Order, Cart)],
+            [3, 2, 12, 4, 5, 3],
+        )
+        self.assertFalse(Product.objects.filter(name='Old Product').exists())
+        self.assertTrue(OrderItem.objects.exists())
+        self.assertEqual(
+            set(Product.objects.values_list('id', flat=True)),
+            set(ProductSearchToken.objects.values_list('product', flat=True)),
+        )
+        units = OrderItem.objects.aggregate(units=Sum('quantity'))['units']
+        self.assertEqual(ProductDailySales.objects.aggregate(units=Sum('units'))['units'], units)
+        self.assertEqual(
+            Cart.objects.aggregate(count=Sum('items_count'))['count'],
+            CartItem.objects.aggregate(count=Sum('quantity'))['count'],
+        )
+
+
+class LoadInitialDataTests(TestCase):
+    FIXTURE = """
+        -- A few rows in the shape of database_initial.sql.
+        insert into store_category (id, title, description, top_product_id)
+        values (1, 'Books', 'Reading, mostly', null), (2, 'Tools', 'It''s a tool', null);
+        insert into store_product (
+            id, name, category_id, slug, description, unit_price, inventory, datetime_created, datetime_modified
+        )
+        values
+            (1, 'Blue Book', 1, 'blue-book', '', 10.00, 5, '2021-01-26 18:46:57', '2021-01-29 08:48:03'),
+            (2, 'Red Hammer', 2, 'red-hammer', '', 25.53, 34, '2021-01-26 18:46:57', '2021-01-29 08:48:03');
+        insert into store_discount (id, discount, description) values (1, 42.65, 'Spring');
+        insert into store_customer (id, first_name, last_name, email, phone_number, birth_date)
+        values (1, 'Ada', 'Lovelace', 'ada@example.com', '555', '1990-01-01'),
+            (2, 'Alan', 'Turing', 'ada@example.com', '556', null);
+        insert into store_address (customer_id, province, city, street) values (1, 'P', 'C', 'S');
+        insert into store_order (id, customer_id, datetime_created, status) values (1, 1, '2021-02-01 10:00:00', 'p');
+        insert into store_orderitem (id, order_id, product_id, quantity, unit_price) values (1, 1, 1, 2, 10.00);
+        insert into store_comment (id, product_id, name, body, datetime_created, status)
+        values (1, 1, 'Ada', 'Great', '2021-02-02 10:00:00', 'a');
+        insert into store_cart (id, created_at) values (7, '2021-02-03 10:00:00');
+        insert into store_cartitem (id, cart_id, product_id, quantity) values (1, 7, 2, 3);
+    """
+
+    def test_small_fixture(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.sql') as fixture:
+            fixture.write(self.FIXTURE)
+            fixture.flush()
+            call_command('load_initial_data', fixture.name, '--batch-size=1', stdout=StringIO())
+        self.assertEqual(
+            [model.objects.count() for model in (Category, Product, Discount, Customer, Order, OrderItem, Comment, Cart)],
+            [2, 2, 1, 2, 1, 1, 1, 1],
+        )
+        self.assertEqual(Category.objects.get(pk=2).description, "It's a tool")
+        self.assertEqual(Discount.objects.get().discount, 0.4265)
+        self.assertEqual(
+            sorted(Customer.objects.values_list('user__email', flat=True)), ['ada+2@example.com', 'ada@example.com'],
+        )
+        self.assertEqual(Product.objects.get(pk=1).datetime_created.year, 2021)
+        cart = Cart.objects.get()
+        self.assertEqual((cart.pk.int, cart.items_count), (7, 3))
+        self.assertEqual(Product.objects.get(pk=1).approved_comment_count, 1)
+        self.assertTrue(ProductSearchToken.objects.filter(product_id=2, token='hammer').exists())
+        self.assertEqual(ProductDailySales.objects.get(product_id=1).units, 2)
+
+    def test_unsupported_statements_are_rejected(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.sql') as fixture:
+            fixture.write('delete from store_product;')
+            fixture.flush()
+            with self.assertRaises(CommandError):
+                call_command('load_initial_data', fixture.name, stdout=StringIO())
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Replicas')
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        token = replica_reads.set(True)
+        try:
+            # TestCase wraps every test in a transaction on the primary.
+            self.assertEqual(router.db_for_read(Product), 'default')
+            with mock.patch.object(connections['default'], 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Product), 'replica')
+        finally:
+            replica_reads.reset(token)
+        self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'store'))
+        self.assertTrue(router.allow_migrate('default', 'store'))
+
+    def reads(self, client, method, path, data=None):
+        """The `replica_reads` value of each read the request routes."""
+        seen = []
+
+        def db_for_read(router, model, **hints):
+            seen.append(replica_reads.get())
+            return 'default'
+
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', autospec=True, side_effect=db_for_read):
+            response = getattr(client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400)
+        return set(seen), response
+
+    def test_store_reads_go_to_replicas_until_the_client_writes(self):
+        client = APIClient()
+        self.assertEqual(self.reads(client, 'get', '/store/categories/')[0], {True})
+        _, response = self.reads(client, 'post', '/store/carts/')
+        self.assertIn('primary_reads', response.cookies)
+        cart = response.json()['id']
+        self.assertEqual(self.reads(client, 'get', f'/store/carts/{cart}/')[0], {False})
+        self.assertEqual(self.reads(APIClient(), 'get', f'/store/carts/{cart}/')[0], {True})
+
+    def test_cached_responses_are_computed_on_the_primary(self):
+        product = Product.objects.create(
+            name='Replica Product', slug='replica-product', category=self.category, unit_price=1, inventory=1,
+        )
+        product_cache.invalidate()
+        comment_cache.invalidate()
+        for path in ['/store/products/', f'/store/products/{product.id}/', f'/store/products/{product.id}/comments/']:
+            with self.subTest(path=path):
+                seen, response = self.reads(APIClient(), 'get', path)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual(seen, {False})
+
+    def test_uncached_responses_read_from_replicas(self):
+        client = APIClient()
+        client.force_authenticate(benchmarks.benchmark_user('replica-user'))
+        seen, response = self.reads(client, 'get', '/store/products/')
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(seen, {True})
+
+    @override_settings(STORE_CACHE_TIMEOUT=None)
+    def test_cached_responses_expire(self):
+        product_cache.invalidate()
+        with mock.patch.object(product_cache.cache, 'set', wraps=product_cache.cache.set) as cache_set:
+            APIClient().get('/store/products/')
+        timeouts = [call.args[2] for call in cache_set.call_args_list]
+        self.assertEqual(timeouts, [product_cache.default_timeout])
+
+
+class RequestProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = benchmarks.seed(products=5, orders=3, items_per_order=2)
+
+    def get(self, path):
+        """The response and profile log line of a staff GET, with the queries it ran."""
+        client = APIClient()
+        client.force_authenticate(self.seeded['users']['staff'])
+        with self.assertLogs('core.requests', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(logs.records), 1)
+        return response, json.loads(logs.records[0].getMessage()), queries
+
+    def test_profile(self):
+        sampled = RequestProfile(keep_queries=True)
+        unsampled = RequestProfile()
+        for profile in sampled, unsampled:
+            for params in [(1,), [2], [1], [[1], [2]], [[1], [2]]]:
+                profile(lambda *args: None, 'SELECT %s', params, False, {})
+            self.assertEqual(profile.query_count, 5)
+            self.assertEqual(profile.duplicate_count, 2)
+        self.assertEqual([query['params'] for query in sampled.queries][:3], ['(1,)', '[2]', '[1]'])
+        self.assertIsNone(unsampled.queries)
+
+    def test_server_timing_and_log_line(self):
+        response, line, queries = self.get('/store/categories/')
+        self.assertEqual(line['queries'], len(queries))
+        self.assertEqual(line['status'], 200)
+        self.assertIn(f'db;dur={line["db_ms"]:.1f};desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertIn(f'dup;desc="{line["duplicate_queries"]} duplicate queries"', response['Server-Timing'])
+        self.assertFalse(SlowRequest.objects.exists())
+
+    def test_streaming_body_queries_are_measured(self):
+        with mock.patch.object(ProductViewSet, 'export_chunk_size', 2):
+            response, line, queries = self.get('/store/products/export/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertGreater(len([query for query in queries if 'store_product' in query['sql']]), 1)
+        self.assertEqual(line['queries'], len(queries))
+
+    def test_unread_streaming_body_is_finished_on_close(self):
+        client = APIClient()
+        client.force_authenticate(self.seeded['users']['staff'])
+        with self.assertLogs('core.requests', 'INFO') as logs:
+            response = client.get('/store/products/export/')
+            self.assertEqual(logs.records, [])
+            response.close()
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(connection.execute_wrappers, [])
+
+    @override_settings(REQUEST_PROFILING_SLOW_MS=500, REQUEST_PROFILING_BUFFER_SIZE=2)
+    def test_slow_requests_are_kept_in_a_ring_buffer(self):
+        paths = [f'/store/categories/?page={page}' for page in range(1, 4)]
+        with mock.patch.object(RequestProfile, 'total_time', new_callable=mock.PropertyMock, return_value=1.0):
+            for path in paths:
+                response, line, _ = self.get(path)
+        self.assertIn('dup;', response['Server-Timing'])
+        samples = list(SlowRequest.objects.order_by('id'))
+        self.assertEqual([sample.path for sample in samples], paths[1:])
+        self.assertEqual(samples[-1].total_ms, 1000)
+        self.assertEqual(samples[-1].query_count, line['queries'])
+        self.assertEqual(len(samples[-1].queries), line['queries'])
+        self.assertEqual(samples[-1].duplicate_count, line['duplicate_queries'])
+
+
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Routes reads to a second SQLite database holding different rows."""
+    alias = 'replica_test'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings[self.alias] = {
+            **connections.settings['default'], 'NAME': f'{directory.name}/replica.sqlite3', 'CONN_MAX_AGE': 0,
+        }
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(connections[self.alias].close)
+        with connections[self.alias].schema_editor() as editor:
+            editor.create_model(Category)
+            editor.create_model(Product)
+        Category.objects.create(title='On the primary')
+        Category.objects.using(self.alias).create(title='On the replica')
+
+    def titles(self, client):
+        return [category['title'] for category in client.get('/store/categories/').json()]
+
+    def test_reads_go_to_the_replica_until_the_client_writes(self):
+        client = APIClient()
+        with override_settings(DATABASE_REPLICAS=[self.alias]):
+            self.assertEqual(self.titles(client), ['On the replica'])
+            self.assertEqual(client.post('/store/carts/').status_code, 201)
+            self.assertEqual(self.titles(client), ['On the primary'])
+        self.assertEqual(self.titles(APIClient()), ['On the primary'])
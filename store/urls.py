@@ -10,6 +10,8 @@ router.register('categories', viewset=views.CategoryViewSet, basename='category'
 router.register('carts', viewset=views.CartViewSet, basename='cart')
 router.register('customers', viewset=views.CustomerViewSet, basename='customer')
 router.register('orders', viewset=views.OrderViewSet, basename='order')
+router.register('sales', viewset=views.SalesReportViewSet, basename='sales')
+router.register('cache-stats', viewset=views.CacheStatsViewSet, basename='cache-stats')
 
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register(r'comments', viewset=views.CommentViewSet, basename='product-comments')
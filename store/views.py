@@ -3,37 +3,108 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import RetrieveModelMixin, CreateModelMixin, DestroyModelMixin
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
-from rest_framework.permissions import IsAdminUser, IsAuthenticated, DjangoModelPermissions
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated, DjangoModelPermissions
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Count, Prefetch
 
 from .models import Cart, CartItem, Category, Customer, Order, OrderItem, Product, Comment
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CategorySerializer, CommentSerializer, CustomerSerializer, OrderCreateSerializer, OrderForAdminSerializer, OrderForUserSerializer, OrderUpdateSerializer, ProductSerializer, UpdateCartItemSerializer
-from .filters import ProductFilter
-from .paginations import DefaultPagination
+from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CategorySerializer, CommentSerializer, CustomerSerializer, OrderCreateSerializer, OrderForAdminSerializer, OrderForAdminValuesSerializer, OrderForUserSerializer, OrderForUserValuesSerializer, OrderUpdateSerializer, ProductBulkSerializer, ProductSerializer, ProductValuesSerializer, SalesReportParamsSerializer, SalesReportSerializer, UpdateCartItemSerializer
+from .caching import RESPONSE_CACHES, CachedResponseMixin, ConditionalGetMixin, ConditionalRetrieveMixin, comment_cache, product_cache
+from .exports import ExportMixin
+from .fieldsets import fieldset_params
+from .filters import ProductFilter, ProductSearchFilter, facet_counts, facet_params
+from .paginations import CommentFeedPagination, DefaultPagination, KeysetPaginationMixin
+from .parsers import NDJSONParser
 from .permissions import CustomDjangoModelPermissions, IsAdminOrReadOnly
-from .signals import order_created
+from .pruning import PrunedQuerysetMixin
+from . import rollups
 
-class ProductViewSet(ModelViewSet):
+class ValuesListMixin:
+    """
+    Lists `.values()` rows through `values_serializer_class` instead of
+    building model instances for the regular serializer.
+    """
+    values_serializer_class = None
+
+    def get_values_serializer_class(self):
+        return self.values_serializer_class
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.get_values_serializer_class()
+        context = self.get_serializer_context()
+        reader = serializer_class(context=context)
+        queryset = reader.get_values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        rows = reader.prefetch(list(queryset) if page is None else page)
+        serializer = serializer_class(rows, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+
+class FacetedListMixin:
+    """
+    Adds the `?facets=` counts of the filtered queryset, see
+    store.filters.facet_counts, to the paginated list response.
+    """
+
+    def list(self, request, *args, **kwargs):
+        facets = facet_params(request)
+        response = super().list(request, *args, **kwargs)
+        if facets and isinstance(response.data, dict):
+            response.data['facets'] = facet_counts(self.filter_queryset(self.get_queryset()), facets)
+        return response
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, KeysetPaginationMixin, ExportMixin, FacetedListMixin, ValuesListMixin, PrunedQuerysetMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValuesSerializer
     queryset = Product.objects.all()
-    filter_backends = [SearchFilter, DjangoFilterBackend, OrderingFilter, ]
-    ordering_fields = ['name', 'unit_price', 'inventory']
+    filter_backends = [ProductSearchFilter, DjangoFilterBackend, OrderingFilter, ]
+    ordering_fields = ['name', 'unit_price', 'effective_price', 'inventory']
     search_fields = ['name', 'category__title']
     # pagination_class = PageNumberPagination
     pagination_class = DefaultPagination
     # filterset_fields = ['category_id', 'inventory']
     filterset_class = ProductFilter
     permission_classes = [IsAdminOrReadOnly, ]
+    response_cache = product_cache
 
+    def get_serializer_context(self):
+        return {'request': self.request, **fieldset_params(self.request)}
 
+    def get_list_validators(self):
+        # Every change that can alter a product list bumps the cache version,
+        # so it validates any list without querying the catalog.
+        return str(product_cache.get_version()), product_cache.get_last_modified()
 
-    def get_serializer_context(self):
-        return {'request': self.request}
+    def get_detail_validators(self):
+        # An expanded category is part of the response, so its changes are too.
+        columns = ['datetime_modified']
+        if 'category' in (fieldset_params(self.request)['expand'] or []):
+            columns.append('category__datetime_modified')
+        modified = Product.objects.filter(pk=self.kwargs['pk']).values_list(*columns).first()
+        return modified and (':'.join(value.isoformat() for value in modified), max(modified))
+
+    @action(detail=False, methods=['POST'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Creates and replaces products from a JSON array or an NDJSON stream.
+        Nothing is written unless every row is valid; the errors are returned
+        per row, in the order of the input.
+        """
+        serializer = ProductBulkSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        updated = sum('id' in row for row in serializer.validated_data)
+        serializer.save()
+        return Response({'created': len(serializer.validated_data) - updated, 'updated': updated})
 
     def destroy(self, request, pk):
         product = get_object_or_404(Product.objects.select_related('category'), pk=pk)
@@ -42,46 +113,66 @@ class ProductViewSet(ModelViewSet):
         product.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = CategorySerializer
-    queryset =  Category.objects.prefetch_related('products')
+    queryset = Category.objects.annotate(products_count=Count('products'))
     permission_classes = [IsAdminOrReadOnly, ]
 
+    def get_list_validators(self):
+        # Categories and their product counts change only with writes that
+        # bump the product cache version, so no catalog scan is needed.
+        return str(product_cache.get_version()), product_cache.get_last_modified()
+
+    def get_detail_validators(self):
+        return self.get_list_validators()
+
     def destroy(self, request, pk):
-        category = get_object_or_404(Category.objects.annotate(products_count=Count('products')), pk=pk)
-        if category.products.count() > 0:
+        category = get_object_or_404(self.get_queryset(), pk=pk)
+        if category.products_count > 0:
             return Response({'error': "There is some product item in this category. Please remove them first."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         category.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CommentViewSet(ModelViewSet):
+class CommentViewSet(CachedResponseMixin, PrunedQuerysetMixin, ModelViewSet):
     serializer_class = CommentSerializer
+    pagination_class = CommentFeedPagination
+    response_cache = comment_cache
     
     def get_queryset(self):
         product_pk = self.kwargs['product_pk']
+        # Readers only see approved comments; waiting ones are still reachable for edits.
+        if self.request.method in SAFE_METHODS:
+            return Comment.approved.filter(product_id=product_pk)
         return Comment.objects.filter(product_id=product_pk)
     
     def get_serializer_context(self):
         return {'product_pk': self.kwargs['product_pk']}
     
 
-class CartViewSet(CreateModelMixin,
+class CartViewSet(ConditionalRetrieveMixin,
+                   PrunedQuerysetMixin,
+                   CreateModelMixin,
                    RetrieveModelMixin,
                    DestroyModelMixin,
                    GenericViewSet):
     serializer_class = CartSerializer
-    queryset = Cart.objects.prefetch_related('items__product')
+    queryset = Cart.objects.all()
     lookup_value_regex = '[0-9a-fA-F]{8}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{12}' 
 
+    def get_detail_validators(self):
+        version = Cart.objects.filter(pk=self.kwargs['pk']).values_list('version', flat=True).first()
+        return version and (str(version), None)
 
 
-class CartItemViewSet(ModelViewSet):
+
+class CartItemViewSet(PrunedQuerysetMixin, ModelViewSet):
     serializer_class = CartItemSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
     def get_queryset(self):
         cart_pk = self.kwargs.get('cart_pk')
-        queryset = CartItem.objects.select_related('product').filter(cart_id=cart_pk)
+        queryset = CartItem.objects.select_related('product') \
+            .filter(cart_id=cart_pk)
         return queryset
     
     def get_serializer_class(self):
@@ -93,9 +184,24 @@ class CartItemViewSet(ModelViewSet):
     
     def get_serializer_context(self):
         return {'cart_pk': self.kwargs.get('cart_pk')}
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # The cart row is locked before the item, in the order checkout
+            # locks them, and the quantity is read again under the locks.
+            Cart.objects.filter(pk=instance.cart_id).lock()
+            quantity = CartItem.objects.select_for_update() \
+                .filter(pk=instance.pk) \
+                .values_list('quantity', flat=True) \
+                .first()
+            if quantity is None:
+                return
+            instance.delete()
+            Cart.objects.filter(pk=instance.cart_id) \
+                .add_to_totals(-quantity, -quantity * instance.product.effective_price)
     
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(PrunedQuerysetMixin, ModelViewSet):
     serializer_class = CustomerSerializer
     queryset = Customer.objects.all()
     permission_classes = [IsAdminUser]
@@ -114,11 +220,13 @@ class CustomerViewSet(ModelViewSet):
 
         return Response(serializer.data)
     
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(KeysetPaginationMixin, ExportMixin, ValuesListMixin, PrunedQuerysetMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'option', 'head']
     filter_backends = [OrderingFilter, ]
     ordering_fields = ['id', 'customer', 'datetime_created']
     def get_permissions(self):
+        if self.action == 'export':
+            return super().get_permissions()
         if self.request.method in ['PATCH', "DELETE"]:
             return [IsAdminUser()]
         return [IsAuthenticated()]
@@ -142,14 +250,39 @@ class OrderViewSet(ModelViewSet):
         if self.request.user.is_staff:
             return OrderForAdminSerializer
         return OrderForUserSerializer
+
+    def get_values_serializer_class(self):
+        if self.request.user.is_staff:
+            return OrderForAdminValuesSerializer
+        return OrderForUserValuesSerializer
     
     def get_serializer_context(self):
-        return {'user_id': self.request.user.id}
+        return {'user_id': self.request.user.id, **fieldset_params(self.request)}
     
     def create(self, request, *args, **kwargs):
         create_order_serializer = OrderCreateSerializer(data=request.data, context={'user_id': self.request.user.id})
         create_order_serializer.is_valid(raise_exception=True)
         created_order = create_order_serializer.save()
-        order_created.send_robust(self.__class__, order=created_order)
-        serializer = OrderForUserSerializer(created_order)
-        return Response(serializer.data)
\ No newline at end of file
+        serializer = OrderForUserSerializer(self.get_queryset().get(pk=created_order.pk))
+        return Response(serializer.data)
+
+
+class SalesReportViewSet(GenericViewSet):
+    """Daily sales served from the rollup tables, see store.rollups.daily_report."""
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        params = SalesReportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows = rollups.daily_report(**params.validated_data)
+        return Response(SalesReportSerializer(rows, many=True).data)
+
+
+class CacheStatsViewSet(GenericViewSet):
+    """Hits and misses of the response caches, counted by the process answering."""
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        return Response({
+            cache.namespace: {**cache.stats(), 'version': cache.get_version()} for cache in RESPONSE_CACHES
+        })